@@ -6,6 +6,8 @@ Interface to the kinect hardware.
 """
 
 from collections import namedtuple
+import threading
+import time
 import numpy
 
 try:
@@ -14,19 +16,53 @@ except ImportError:
     freenect = None
     print "Kinect module not found. Faking it"
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 __all__ = ['get_buffers',
            'set_default_data',
+           'KinectData',
+           'KinectFrame',
+           'RGB_STREAM',
+           'DEPTH_STREAM',
+           'ALL_STREAMS',
+           'FrameGrabber',
+           'FreenectDevice',
+           'FakeDevice',
+           'start_acquisition',
+           'stop_acquisition',
            'z_to_cm',
+           'crop_band',
            'x_to_cm',
            'y_to_cm',
+           'CoordinateGrid',
+           'to_point_cloud',
+           'OccupancyGrid',
+           'coordinate_grid',
            'extract_obstacles',
+           'SEGMENTATION_BACKENDS',
+           'DEFAULT_SEGMENTATION_BACKEND',
+           'NumpySegmentation',
+           'DepthProcessor',
+           'BackgroundModel',
+           'IncrementalDepthProcessor',
            'get_obstacles',
+           'Track',
+           'ObstacleTracker',
+           'ObstacleEvent',
+           'ObstacleEvents',
+           'FOOT_ENTERED',
+           'FOOT_MOVED',
+           'FOOT_LEFT',
            'UNDEF_DEPTH',
            'UNDEF_DISTANCE',
            '_MIN_DISTANCE',
            '_MAX_DISTANCE']
 
 _DEFAULT_ANALYSIS_BAND = (37, 196, 566, 85)
+_FULL_FRAME = (0, 0, 640, 480)
 _DEFAULT_SURFACE = (-9999, -9999, 9999, 9999)
 
 
@@ -59,9 +95,14 @@ _DIST_ARRAY = numpy.where(
 # Returned by get_buffers
 KinectData = namedtuple('KinectData', 'real_kinect rgb depth')
 
+# Streams that can be requested from the acquisition functions.
+RGB_STREAM = 'rgb'
+DEPTH_STREAM = 'depth'
+ALL_STREAMS = (RGB_STREAM, DEPTH_STREAM)
+
 
-def get_buffers():
-    '''get_buffers(): returns a KinectData object
+def get_buffers(streams=ALL_STREAMS):
+    '''get_buffers(streams=ALL_STREAMS): returns a KinectData object
     KinectData members:
      - real_kinect (boolean) (true if data comes fro ma real kinect)
      - rgb array
@@ -69,16 +110,37 @@ def get_buffers():
 
      (buffers=numpy array)
 
+     streams tells which of RGB_STREAM and DEPTH_STREAM are wanted. Streams
+     not requested are not fetched from the device and are None.
+
      the input is taken from a file if the kinect is missing or the library not
      present. No memorization is done.
+
+     When background acquisition runs (see start_acquisition), the latest
+     acquired frame is returned without waiting for the device.
      '''
+    want_rgb = RGB_STREAM in streams
+    want_depth = DEPTH_STREAM in streams
+
+    if _GRABBER is not None:
+        frame = _GRABBER.latest()
+        if frame is not None and (frame.rgb is not None or not want_rgb) \
+                and (frame.depth is not None or not want_depth):
+            return KinectData(
+                real_kinect=frame.real_kinect,
+                rgb=frame.rgb if want_rgb else None,
+                depth=frame.depth if want_depth else None)
+
     found_kinect = False
+    rgb = depth = None
 
     if freenect:  # module has been imported
         try:
             # Try to obtain Kinect images.
-            (depth, _), (rgb, _) = \
-                    freenect.sync_get_depth(), freenect.sync_get_video()
+            if want_depth:
+                depth, _ = freenect.sync_get_depth()
+            if want_rgb:
+                rgb, _ = freenect.sync_get_video()
             found_kinect = True
         except TypeError:
             pass
@@ -87,7 +149,10 @@ def get_buffers():
         return KinectData(real_kinect=True, rgb=rgb, depth=depth)
     else:
         # Use local data files. not defined if not initialized
-        return _DEFAULT_DATA
+        return KinectData(
+            real_kinect=False,
+            rgb=_DEFAULT_DATA.rgb if want_rgb else None,
+            depth=_DEFAULT_DATA.depth if want_depth else None)
 
 
 def set_default_data(filename):
@@ -103,23 +168,412 @@ def set_default_data(filename):
         )
 
 
-def z_to_cm(depth):
-    "from a depth (or depth buffer), convert to depth in centimeters"
-    return _DIST_ARRAY[depth]
+# ----------------------------------------------
+# Asynchronous acquisition.
+#
+# A FrameGrabber runs a device in a background thread. The device calls back
+# with every depth and video buffer it gets; the grabber copies them into a
+# small ring of preallocated buffers and publishes a KinectFrame once both
+# planes of a slot are filled.
+
+# Returned by FrameGrabber.latest and FrameGrabber.next_frame
+KinectFrame = namedtuple('KinectFrame', 'real_kinect rgb depth index timestamp')
+
+_DEPTH_SHAPE = (480, 640)
+_RGB_SHAPE = (480, 640, 3)
+
+
+class FreenectDevice(object):
+    "Real Kinect, driven by the freenect callback API."
+
+    real_kinect = True
+
+    def run(self, on_depth, on_video, stopped):
+        '''Calls on_depth and on_video with each buffer until stopped is set.
+        A stream whose callback is None is not started.'''
+        def depth_cb(dev, data, timestamp):
+            on_depth(data)
 
+        def video_cb(dev, data, timestamp):
+            on_video(data)
 
-def x_to_cm(x, z):
-    "from a depth in cm and x, converts to x in centimeters"
-    coeff = 0.001734  # Measured constant.
-    return (320.0 - x) * z * coeff
+        def body(dev, ctx):
+            if stopped.is_set():
+                raise freenect.Kill
 
+        freenect.runloop(
+                depth=depth_cb if on_depth else None,
+                video=video_cb if on_video else None,
+                body=body)
 
-def y_to_cm(y, z):
-    'from a depth in cm and y, converts to y height in centimeters'
-    coeff = 0.001734  # Measured constant.
-    dev = 9 / coeff / 200  # Horizon is not at y = 0.
-    h = 6.0  # Kinect captor is not at y = 0.
-    return ((480.0 - y) - 240.0 - dev) * z * coeff + h
+
+class FakeDevice(object):
+    '''Replays recorded files (without extension, see set_default_data) at a
+    given rate in frames per second, looping over them.'''
+
+    real_kinect = False
+
+    def __init__(self, filenames, rate=30.0):
+        self._frames = [(numpy.load(f + '_depth.npy'),
+                         numpy.load(f + '_rgb.npy')) for f in filenames]
+        self._period = 1.0 / rate
+
+    def run(self, on_depth, on_video, stopped):
+        deadline = time.time()
+        while not stopped.is_set():
+            for depth, rgb in self._frames:
+                if on_video:
+                    on_video(rgb)
+                if on_depth:
+                    on_depth(depth)
+                deadline += self._period
+                if stopped.wait(max(0.0, deadline - time.time())):
+                    return
+
+
+class FrameGrabber(object):
+    '''Background acquisition of Kinect frames.
+
+    grabber = FrameGrabber(device, ring_size=3, streams=ALL_STREAMS,
+                           band=None)
+        device:     FreenectDevice or FakeDevice
+        ring_size:  number of preallocated frame buffers
+        streams:    acquired streams, the others are None in frames
+        band:       if given (x, y, w, h), only this band of the depth buffer
+                    is kept (see crop_band)
+
+    Returned frames point into the ring: they stay valid until ring_size - 1
+    newer frames have been published. Copy them to keep them longer.
+    '''
+
+    def __init__(self, device, ring_size=3, streams=ALL_STREAMS, band=None):
+        self._device = device
+        self.real_kinect = device.real_kinect
+        self._ring_size = ring_size
+        self._band = band
+        self._depth = self._rgb = None
+        if DEPTH_STREAM in streams:
+            shape = _DEPTH_SHAPE if band is None else (band[3], band[2])
+            self._depth = numpy.empty((ring_size,) + shape, numpy.uint16)
+        if RGB_STREAM in streams:
+            self._rgb = numpy.empty((ring_size,) + _RGB_SHAPE, numpy.uint8)
+        self._slot = 0
+        # A stream not acquired is always there.
+        self._has_depth = self._depth is None
+        self._has_rgb = self._rgb is None
+        self._count = 0
+        self._latest = None
+        self._ready = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='kinect-acquisition')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        try:
+            self._device.run(
+                    self._on_depth if self._depth is not None else None,
+                    self._on_video if self._rgb is not None else None,
+                    self._stopped)
+        finally:
+            # Wake up anyone waiting for a frame that will never come.
+            with self._ready:
+                self._ready.notify_all()
+
+    def _on_depth(self, data):
+        if self._band is not None:
+            data = crop_band(data, self._band)
+        self._depth[self._slot] = data
+        self._has_depth = True
+        self._publish()
+
+    def _on_video(self, data):
+        self._rgb[self._slot] = data
+        self._has_rgb = True
+        self._publish()
+
+    def _publish(self):
+        if not (self._has_depth and self._has_rgb):
+            return
+        slot = self._slot
+        frame = KinectFrame(
+            real_kinect=self.real_kinect,
+            rgb=self._rgb[slot] if self._rgb is not None else None,
+            depth=self._depth[slot] if self._depth is not None else None,
+            index=self._count,
+            timestamp=time.time())
+        with self._ready:
+            self._latest = frame
+            self._count += 1
+            self._ready.notify_all()
+        self._slot = (slot + 1) % self._ring_size
+        self._has_depth = self._depth is None
+        self._has_rgb = self._rgb is None
+
+    def latest(self):
+        "Newest published frame, or None. Never blocks."
+        return self._latest
+
+    def next_frame(self, after=None, timeout=None):
+        '''Waits for a frame newer than the frame index `after` (by default,
+        newer than the latest one) and returns it. Returns None on timeout or
+        when acquisition stopped.'''
+        if after is None:
+            latest = self._latest
+            after = latest.index if latest else -1
+        deadline = None if timeout is None else time.time() + timeout
+        with self._ready:
+            while self._latest is None or self._latest.index <= after:
+                if not self.is_running():
+                    return None
+                if deadline is None:
+                    self._ready.wait(0.1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._ready.wait(min(remaining, 0.1))
+            return self._latest
+
+
+_GRABBER = None
+
+
+def start_acquisition(device=None, ring_size=3, streams=ALL_STREAMS,
+                      band=None):
+    '''Starts background acquisition, on the real Kinect by default.
+    get_buffers then returns the latest acquired frame.'''
+    global _GRABBER
+    stop_acquisition()
+    if device is None:
+        device = FreenectDevice()
+    _GRABBER = FrameGrabber(device, ring_size, streams, band).start()
+    return _GRABBER
+
+
+def stop_acquisition():
+    global _GRABBER
+    if _GRABBER is not None:
+        _GRABBER.stop()
+        _GRABBER = None
+
+
+def z_to_cm(depth, out=None):
+    """from a depth (or depth buffer), convert to depth in centimeters
+
+    out: optional float array of the shape of depth receiving the result"""
+    if out is None:
+        return _DIST_ARRAY[depth]
+    return numpy.take(_DIST_ARRAY, depth, out=out)
+
+
+def crop_band(depth, band=_DEFAULT_ANALYSIS_BAND):
+    """returns the band (x, y, w, h) of a depth buffer, without copy.
+
+    A buffer that already has the band size is considered cropped."""
+    bx, by, bw, bh = band
+    if depth.shape == (bh, bw):
+        return depth
+    return depth[by:by + bh, bx:bx + bw]
+
+
+_COEFF = 0.001734  # Measured constant.
+_HORIZON_DEV = 9 / _COEFF / 200  # Horizon is not at y = 0.
+_CAPTOR_HEIGHT = 6.0  # Kinect captor is not at y = 0.
+
+
+def x_to_cm(x, z, out=None):
+    """from a depth in cm and x, converts to x in centimeters
+
+    out: optional float array receiving the result, for array inputs"""
+    if out is None:
+        return (320.0 - x) * z * _COEFF
+    numpy.subtract(320.0, x, out=out)
+    out *= z
+    out *= _COEFF
+    return out
+
+
+def y_to_cm(y, z, out=None):
+    """from a depth in cm and y, converts to y height in centimeters
+
+    out: optional float array receiving the result, for array inputs"""
+    if out is None:
+        return ((480.0 - y) - 240.0 - _HORIZON_DEV) * z * _COEFF \
+                + _CAPTOR_HEIGHT
+    numpy.subtract(480.0, y, out=out)
+    out -= 240.0
+    out -= _HORIZON_DEV
+    out *= z
+    out *= _COEFF
+    out += _CAPTOR_HEIGHT
+    return out
+
+
+class CoordinateGrid(object):
+    '''Pixel to world coordinates of a band (x, y, w, h), in centimeters.
+
+    The per pixel factors of x_to_cm and y_to_cm do not depend on depth:
+    they are computed once, and world coordinates of a depth buffer are then
+    a couple of broadcasts. Results are the same as x_to_cm and y_to_cm.
+    Grids are cached, get them with coordinate_grid.
+    '''
+
+    def __init__(self, band=_FULL_FRAME, dtype=numpy.float64):
+        self.band = band
+        bx, by, bw, bh = band
+        self._lut = _DIST_ARRAY.astype(dtype)
+        self.x_offsets = (320.0 - numpy.arange(bx, bx + bw)).astype(dtype)
+        self.y_offsets = ((480.0 - numpy.arange(by, by + bh)) - 240.0
+                          - _HORIZON_DEV).astype(dtype)
+        self.x_offsets.flags.writeable = False
+        self.y_offsets.flags.writeable = False
+
+    def to_world(self, depth):
+        '''returns x, y, z arrays in cm of the band of a depth buffer, full
+        frame or already cropped. Undefined pixels have z = UNDEF_DISTANCE.'''
+        z = self._lut[crop_band(depth, self.band)]
+        x = self.x_offsets * z
+        x *= _COEFF
+        y = self.y_offsets[:, None] * z
+        y *= _COEFF
+        y += _CAPTOR_HEIGHT
+        return x, y, z
+
+    def x_to_cm(self, x, z, out=None):
+        "x_to_cm for integer arrays of columns x of the band"
+        out = numpy.take(self.x_offsets, x, out=out, mode='clip')
+        out *= z
+        out *= _COEFF
+        return out
+
+    def y_to_cm(self, y, z, out=None):
+        "y_to_cm for integer arrays of rows y of the band"
+        out = numpy.take(self.y_offsets, y, out=out, mode='clip')
+        out *= z
+        out *= _COEFF
+        out += _CAPTOR_HEIGHT
+        return out
+
+
+_GRIDS = {}
+
+
+def coordinate_grid(band=_FULL_FRAME, dtype=numpy.float64):
+    "returns the CoordinateGrid of a band, shared between callers"
+    key = tuple(band), numpy.dtype(dtype)
+    try:
+        return _GRIDS[key]
+    except KeyError:
+        return _GRIDS.setdefault(key, CoordinateGrid(key[0], dtype))
+
+
+def to_point_cloud(depth, band=None, stride=1):
+    '''Returns the valid points of a depth buffer in world coordinates.
+    to_point_cloud(depth, band=None, stride=1):
+        depth:      depth array, full frame or already cropped to the band
+        band:       an optional band in pixels (x, y, w, h), full frame
+                    by default
+        stride:     keep one pixel out of stride in both directions
+
+        returns a contiguous float32 (N, 3) array of (x, y, z) points in
+        centimeters, as given by x_to_cm, y_to_cm and z_to_cm.
+    '''
+    if band is None:
+        band = _FULL_FRAME
+    grid = coordinate_grid(band, numpy.float32)
+    z = grid._lut[crop_band(depth, band)[::stride, ::stride]]
+    rows, columns = numpy.nonzero(z != _UNDEF_DISTANCE)
+    z = z[rows, columns]
+
+    cloud = numpy.empty((z.size, 3), numpy.float32)
+    cloud[:, 0] = grid.x_to_cm(columns * stride, z)
+    cloud[:, 1] = grid.y_to_cm(rows * stride, z)
+    cloud[:, 2] = z
+    return cloud
+
+
+_DEFAULT_GAMING_AREA = (-150.0, 100.0, 150.0, 300.0)  # cm (x0, z0, x1, z1)
+
+
+class OccupancyGrid(object):
+    '''Top view occupancy bitmap of the gaming area.
+
+    grid = OccupancyGrid(area=..., resolution=2.0, band=..., threshold=1)
+        area:       gaming area in cm (x0, z0, x1, z1), top view
+        resolution: cell size in cm
+        band:       analysis band in pixels (x, y, w, h) of depth frames
+        threshold:  points a cell needs to be occupied
+
+    cells is a uint8 array of (rows along z, columns along x): the number of
+    points of the analysis band seen in each cell, saturated at 255. It is
+    updated in place and can be shared, with a renderer for instance.
+    '''
+
+    def __init__(self, area=_DEFAULT_GAMING_AREA, resolution=2.0,
+                 band=_DEFAULT_ANALYSIS_BAND, threshold=1):
+        self.area = area
+        self.resolution = resolution
+        self.band = band
+        self.threshold = threshold
+        x0, z0, x1, z1 = area
+        self.shape = (int(numpy.ceil((z1 - z0) / resolution)),
+                      int(numpy.ceil((x1 - x0) / resolution)))
+        self.cells = numpy.zeros(self.shape, numpy.uint8)
+
+    def _cell(self, x, z):
+        "rows, columns and whether x, z in cm are in the area"
+        x0, z0, x1, z1 = self.area
+        rows = numpy.floor((numpy.asarray(z) - z0) / self.resolution) \
+                .astype(numpy.intp)
+        columns = numpy.floor((numpy.asarray(x) - x0) / self.resolution) \
+                .astype(numpy.intp)
+        inside = (rows >= 0) & (rows < self.shape[0]) \
+                & (columns >= 0) & (columns < self.shape[1])
+        return rows, columns, inside
+
+    def clear(self):
+        self.cells.fill(0)
+
+    def add_points(self, cloud):
+        '''Counts the points of an (N, 3) cloud in cm (see to_point_cloud)
+        into the cells. Points outside the area are ignored.'''
+        rows, columns, inside = self._cell(cloud[:, 0], cloud[:, 2])
+        flat = rows[inside] * self.shape[1] + columns[inside]
+        counts = numpy.bincount(flat, minlength=self.cells.size)
+        counts += self.cells.ravel()
+        numpy.minimum(counts, 255, out=counts)
+        self.cells.ravel()[:] = counts
+
+    def update(self, depth):
+        '''Fills the cells from the analysis band of a depth frame, full
+        frame or already cropped to the band. Returns cells.'''
+        self.clear()
+        self.add_points(to_point_cloud(depth, self.band))
+        return self.cells
+
+    def occupied(self, x, z):
+        '''Whether the cells of x, z in cm are occupied. Takes numbers or
+        arrays, outside of the area is never occupied.'''
+        rows, columns, inside = self._cell(x, z)
+        hits = self.cells[rows.clip(0, self.shape[0] - 1),
+                          columns.clip(0, self.shape[1] - 1)]
+        return inside & (hits >= self.threshold)
 
 
 # Returned by analyzer object.
@@ -138,12 +592,600 @@ class Obstacle (_Obstacle):
             self.x, self.y,
             self.width, self.height,
             self.z,
-             "(has raw data)" if self.raw_data else '(no raw data)'
+             "(has raw data)" if self.raw_data is not None else '(no raw data)'
              )
 # patch the class ...
 #Obstacle.__str__ = show_obstacle
 
 
+class BackgroundModel(object):
+    '''Static background of an analysis band: per pixel median of the
+    defined raw depths of the last learned frames.
+
+    model = BackgroundModel(band=..., frames=30, margin=10.0)
+        frames:     number of frames the running median is taken over
+        margin:     cm a pixel must be closer than the background to be
+                    foreground
+
+    Learn frames of the empty scene with learn(). Until then, everything is
+    foreground. Give the model to a DepthProcessor to only analyze the
+    foreground.
+    '''
+
+    # Raw depths beyond this are undefined (the depth formula diverges).
+    _MONOTONIC = numpy.argmax(numpy.diff(_dist_values) < 0) + 1
+
+    def __init__(self, band=_DEFAULT_ANALYSIS_BAND, frames=30, margin=10.0):
+        self.band = band
+        bx, by, bw, bh = band
+        self.margin = margin
+        self._frames = numpy.empty((frames, bh, bw), numpy.uint16)
+        self._count = 0
+        self._depth = numpy.empty((bh, bw), numpy.uint16)
+        self._depth.fill(_UNDEF_DEPTH)
+        self._limit = self._depth.copy()
+        self._dirty = False
+
+    def __len__(self):
+        "number of frames learned, up to frames"
+        return min(self._count, len(self._frames))
+
+    def learn(self, depth):
+        "Adds a frame of the scene, full frame or already cropped."
+        self._frames[self._count % len(self._frames)] = \
+                crop_band(depth, self.band)
+        self._count += 1
+        self._dirty = True
+
+    def _update(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        # Median of the defined depths of each pixel, the lower one for an
+        # even count: undefined depths (UNDEF_DEPTH and beyond the monotonic
+        # range) sort last. Pixels never defined keep the plain median.
+        frames = numpy.sort(self._frames[:len(self)], axis=0)
+        defined = (frames < self._MONOTONIC).sum(axis=0)
+        middle = numpy.where(defined > 0, (defined - 1) // 2,
+                             (len(frames) - 1) // 2)
+        self._depth[:] = numpy.take_along_axis(frames, middle[None], 0)[0]
+
+        # Foreground is closer than background - margin, that is, since
+        # distance grows with raw depth, lower than the first raw depth at
+        # that distance. Nothing can be closer than a background too close
+        # to be measured, anything can be closer than no background.
+        distance = _DIST_ARRAY[self._depth]
+        limit = numpy.searchsorted(_dist_values[:self._MONOTONIC],
+                                   distance - self.margin)
+        undefined = distance == _UNDEF_DISTANCE
+        too_close = undefined & (self._depth < self._MONOTONIC) \
+                & (_dist_values[self._depth] <= _MIN_DISTANCE)
+        limit[undefined] = _UNDEF_DEPTH
+        limit[too_close] = 0
+        self._limit[:] = limit
+
+    @property
+    def depth(self):
+        "background raw depth, uint16 array of the band shape"
+        self._update()
+        return self._depth
+
+    @property
+    def limit(self):
+        "raw depth under which a pixel is foreground"
+        self._update()
+        return self._limit
+
+    def foreground(self, depth):
+        "foreground mask of a depth buffer, full frame or already cropped"
+        return crop_band(depth, self.band) < self.limit
+
+
+# ----------------------------------------------
+# Segmentation kernels.
+#
+# A kernel separates the feet along the borders of a frame: the lowest point
+# of each non-empty column, in column order. A foot is a run of contiguous
+# columns without an abrupt z change. Points of a foot higher than its base
+# by more than a limit are dropped.
+#
+# kernel = Kernel(size, dtype)
+#     size:   maximum number of border points (band width)
+#     dtype:  float type of z and height
+#
+# count = kernel(x, z, height, foot, kept, max_z_change, max_border_height)
+#     x:      column of the points, in pixels
+#     z:      depth of the points, in cm
+#     height: height of the points, in cm
+#     foot:   filled with the foot number of the points
+#     kept:   filled with whether points are kept
+#     returns the number of feet
+#
+# DepthProcessor uses the backend given to it, DEFAULT_SEGMENTATION_BACKEND
+# by default: the compiled one when numba is available.
+
+
+class NumpySegmentation(object):
+    "Reference segmentation kernel, vectorized with numpy."
+
+    def __init__(self, size, dtype=numpy.float32):
+        self._steps = numpy.empty(size, numpy.intp)
+        self._cut = numpy.empty(size, bool)
+        self._cut2 = numpy.empty(size, bool)
+        self._start = numpy.empty(size, numpy.intp)
+        self._indices = numpy.arange(size)
+        self._base = numpy.empty(size, dtype)
+        self._work = numpy.empty(size, dtype)
+
+    def __call__(self, x, z, height, foot, kept, max_z_change,
+                 max_border_height):
+        n = len(x)
+
+        # Separate disconnected feet.
+        # connected foot : contiguous X and not too abrupt z change
+        cut, cut2 = self._cut[:n - 1], self._cut2[:n - 1]
+        numpy.subtract(x[1:], x[:-1], out=self._steps[:n - 1])
+        numpy.greater(self._steps[:n - 1], 1, out=cut)
+        numpy.subtract(z[1:], z[:-1], out=self._work[:n - 1])
+        numpy.absolute(self._work[:n - 1], out=self._work[:n - 1])
+        numpy.greater_equal(self._work[:n - 1], max_z_change, out=cut2)
+        numpy.logical_or(cut, cut2, out=cut)
+
+        foot[0] = 0
+        numpy.cumsum(cut, out=foot[1:])
+        count = foot[-1] + 1
+        start = self._start[:count]
+        start[0] = 0
+        numpy.compress(cut, self._indices[1:n], out=start[1:])
+
+        # Limit zone height : distance between base and top must be
+        # restricted. shrink foot accordingly (...)
+        base = self._base[:count]
+        numpy.minimum.reduceat(height, start, out=base)  # bas du pied actuel
+        above = numpy.take(base, foot, out=self._work[:n], mode='clip')
+        numpy.subtract(height, above, out=above)
+        numpy.less_equal(above, max_border_height, out=kept)
+        return count
+
+
+def _segment_borders(x, z, height, foot, kept, max_z_change,
+                     max_border_height):
+    "Sequential scan of the borders, compiled by CompiledSegmentation."
+    n = len(x)
+    count = 0
+    start = 0
+    for i in range(1, n + 1):
+        if i < n and x[i] - x[i - 1] <= 1 \
+                and abs(z[i] - z[i - 1]) < max_z_change:
+            continue
+        # Points start to i - 1 make a foot.
+        base = height[start]
+        for j in range(start + 1, i):
+            if height[j] < base:
+                base = height[j]
+        for j in range(start, i):
+            foot[j] = count
+            kept[j] = height[j] - base <= max_border_height
+        count += 1
+        start = i
+    return count
+
+
+SEGMENTATION_BACKENDS = {'numpy': NumpySegmentation}
+
+if numba is not None:
+    class CompiledSegmentation(object):
+        "Segmentation kernel compiled with numba, same results as numpy's."
+
+        _kernel = staticmethod(numba.njit(nogil=True)(_segment_borders))
+
+        def __init__(self, size, dtype=numpy.float32):
+            pass
+
+        def __call__(self, x, z, height, foot, kept, max_z_change,
+                     max_border_height):
+            return self._kernel(x, z, height, foot, kept, max_z_change,
+                                max_border_height)
+
+    SEGMENTATION_BACKENDS['numba'] = CompiledSegmentation
+    DEFAULT_SEGMENTATION_BACKEND = 'numba'
+else:
+    DEFAULT_SEGMENTATION_BACKEND = 'numpy'
+
+
+class DepthProcessor(object):
+    '''Extracts obstacles from the analysis band of successive depth frames.
+
+    processor = DepthProcessor(band=..., dtype=numpy.float32,
+                               background=None, backend=None,
+                               coarse=None, coarse_margin=1)
+        band:       analysis band in pixels (x, y, w, h)
+        dtype:      float type of the centimeter work buffers
+        background: an optional BackgroundModel of the band. Only its
+                    foreground is then analyzed, and columns without
+                    foreground are skipped.
+        backend:    name of the segmentation kernel, one of
+                    SEGMENTATION_BACKENDS, DEFAULT_SEGMENTATION_BACKEND by
+                    default
+        coarse:     if given, a downsampling factor (4 for instance) for a
+                    coarse to fine search, see below
+        coarse_margin: coarse columns added on each side of candidate spans
+
+    In coarse to fine mode, one pixel out of coarse in both directions is
+    first checked. Columns of the band are only analyzed at full resolution
+    around coarse columns with an in-range pixel: their validity is max
+    pooled over coarse_margin coarse columns on each side. Obstacles seen on
+    no sampled pixel are missed: the larger coarse and the smaller
+    coarse_margin, the faster and the less accurate.
+
+    All work buffers are allocated once, sized to the band, and reused for
+    every frame: steady state frames only allocate the returned obstacles
+    and their raw data. A processor must therefore not be shared between
+    threads.
+
+    See extract_obstacles for obstacle definition.
+    '''
+
+    MAX_DEPTH = 300.0  # 3 meters. FIXME Depends on Gaming Zone size.
+    MAX_BORDER_HEIGHT = 5  # cm. a foot can never be higher than this.
+                            # Restrict accordingly.
+    MAX_Z_CHANGE = 10  # cm. consider discutinued foot if Z varies this much or
+                       # more
+
+    def __init__(self, band=_DEFAULT_ANALYSIS_BAND, dtype=numpy.float32,
+                 background=None, backend=None, coarse=None,
+                 coarse_margin=1):
+        self.band = band
+        self.background = background
+        self.coarse = coarse
+        self.coarse_margin = coarse_margin
+        bx, by, bw, bh = band
+        if backend is None:
+            backend = DEFAULT_SEGMENTATION_BACKEND
+        if backend not in SEGMENTATION_BACKENDS:
+            raise ValueError('unknown segmentation backend %r' % backend)
+        self.backend = backend
+        self._segment = SEGMENTATION_BACKENDS[backend](bw, dtype)
+        self._lut = _DIST_ARRAY.astype(dtype)
+        self._grid = coordinate_grid(dtype=dtype)  # x, y are frame pixels
+
+        # Band sized buffers.
+        self._index = numpy.empty((bh, bw), numpy.intp)
+        self.zone = numpy.empty((bh, bw), dtype)  # band in cm
+        self._mask = numpy.empty((bh, bw), bool)
+        self._foreground = numpy.empty((bh, bw), bool)
+        self._row_numbers = numpy.arange(1, bh + 1)[:, None]
+
+        # Column sized buffers. Borders are (x, y, z) of non-empty columns.
+        self._columns = numpy.arange(bw)
+        self._selected = numpy.empty(bw, numpy.intp)
+        self._edges = numpy.empty(bw + 1, numpy.intp)
+        self._edge = numpy.empty(bw, bool)
+        self._ymax = numpy.empty(bw, numpy.intp)
+        self._flat = numpy.empty(bw, numpy.intp)
+        self._column_z = numpy.empty(bw, dtype)
+        self._valid = numpy.empty(bw, bool)
+        self._has_foreground = numpy.empty(bw, bool)
+        self._kept = numpy.empty(bw, bool)
+        self._new_foot = numpy.empty(bw, bool)
+        self._x = numpy.empty(bw, numpy.intp)
+        self._y = numpy.empty(bw, numpy.intp)
+        self._z = numpy.empty(bw, dtype)
+        self._height = numpy.empty(bw, dtype)
+        self._foot = numpy.empty(bw, numpy.intp)
+        self._start = numpy.empty(bw, numpy.intp)
+        self._end = numpy.empty(bw, numpy.intp)
+        self._kept_x = numpy.empty(bw, numpy.intp)
+        self._kept_y = numpy.empty(bw, numpy.intp)
+        self._kept_z = numpy.empty(bw, dtype)
+        self._kept_foot = numpy.empty(bw, numpy.intp)
+        self._x_cm = numpy.empty(bw, dtype)
+
+        # Foot sized buffers (at most one foot per column).
+        self._left = numpy.empty(bw, dtype)
+        self._right = numpy.empty(bw, dtype)
+        self._close = numpy.empty(bw, dtype)
+        self._far = numpy.empty(bw, dtype)
+        self._top = numpy.empty(bw, numpy.intp)
+
+        # Coarse to fine search buffers, coarse rows and columns.
+        if coarse is not None:
+            ch, cw = -(-bh // coarse), -(-bw // coarse)
+            self._coarse_index = numpy.empty((ch, cw), numpy.intp)
+            self._coarse_zone = numpy.empty((ch, cw), dtype)
+            self._coarse_mask = numpy.empty((ch, cw), bool)
+            self._coarse_columns = numpy.empty(cw, bool)
+            self._coarse_pooled = numpy.empty(cw, bool)
+            # Candidate columns at full resolution, by blocks of coarse.
+            self._candidate_blocks = numpy.empty((cw, coarse), bool)
+            self._gathered = numpy.empty(bh * bw, numpy.uint16)
+
+    def extract_obstacles(self, depth, provide_raw=False):
+        '''Returns obstacles from pixel depth, full frame or already cropped
+        to the band. See extract_obstacles.'''
+        self._analyze(crop_band(depth, self.band))
+        return self._obstacles(provide_raw)
+
+    def _analyze(self, band, start=0, stop=None):
+        '''Finds the borders of the columns start:stop of the band, where
+        there is foreground if a background is known, and near in-range
+        coarse pixels in coarse to fine mode.'''
+        if self.background is None and self.coarse is None:
+            self._analyze_columns(band, start, stop)
+            return
+
+        columns = slice(start, stop)
+        has_foreground = self._has_foreground[columns]
+        if self.background is not None:
+            foreground = self._foreground[:, columns]
+            numpy.less(band[:, columns], self.background.limit[:, columns],
+                       out=foreground)
+            numpy.any(foreground, axis=0, out=has_foreground)
+        else:
+            has_foreground.fill(True)
+        if self.coarse is not None:
+            has_foreground &= self._coarse_candidates(band)[columns]
+            self._ymax[columns] = 0
+            k = numpy.count_nonzero(has_foreground)
+            self._analyze_gathered(band, numpy.compress(
+                has_foreground, self._columns[columns],
+                out=self._selected[:k]))
+            return
+        self._ymax[columns] = 0
+
+        for run_start, run_stop in self._runs(has_foreground):
+            self._analyze_columns(band, start + run_start, start + run_stop)
+
+    def _runs(self, flags):
+        "List of (start, stop) of the runs of True of a boolean column array"
+        n = len(flags)
+        edge = self._edge[:n - 1]
+        numpy.not_equal(flags[1:], flags[:-1], out=edge)
+        k = numpy.count_nonzero(edge)
+        edges = self._edges[:k + 2]
+        edges[0] = 0
+        numpy.compress(edge, self._columns[1:n], out=edges[1:k + 1])
+        edges[k + 1] = n
+        first = 0 if flags[0] else 1
+        return zip(edges[first:-1:2], edges[first + 1::2])
+
+    def _coarse_candidates(self, band):
+        "Columns of the band to analyze at full resolution."
+        f = self.coarse
+        numpy.copyto(self._coarse_index, band[::f, ::f])
+        numpy.take(self._lut, self._coarse_index, out=self._coarse_zone,
+                   mode='clip')
+        numpy.less_equal(self._coarse_zone, self.MAX_DEPTH,
+                         out=self._coarse_mask)
+        if self.background is not None:
+            self._coarse_mask &= self._foreground[::f, ::f]
+        valid = self._coarse_columns
+        numpy.any(self._coarse_mask, axis=0, out=valid)
+
+        # Max pooling of coarse columns.
+        pooled = self._coarse_pooled
+        pooled[:] = valid
+        for k in xrange(1, self.coarse_margin + 1):
+            pooled[k:] |= valid[:-k]
+            pooled[:-k] |= valid[k:]
+
+        blocks = self._candidate_blocks
+        blocks[:] = pooled[:, None]
+        return blocks.ravel()[:self.band[2]]
+
+    def _analyze_gathered(self, band, columns):
+        '''Finds the borders of some columns of the band, gathered side by
+        side: see _analyze_columns.'''
+        bh, k = self.band[3], len(columns)
+        if not k:
+            return
+        index = self._index.ravel()[:bh * k].reshape(bh, k)
+        zone = self.zone.ravel()[:bh * k].reshape(bh, k)
+        mask = self._mask.ravel()[:bh * k].reshape(bh, k)
+
+        gathered = self._gathered[:bh * k].reshape(bh, k)
+        numpy.take(band, columns, axis=1, out=gathered, mode='clip')
+        numpy.copyto(index, gathered)
+        numpy.take(self._lut, index, out=zone, mode='clip')
+        numpy.less_equal(zone, self.MAX_DEPTH, out=mask)
+        if self.background is not None:
+            mask &= self._foreground[:, columns]
+        rows = index
+        rows.fill(0)
+        numpy.copyto(rows, self._row_numbers, where=mask)
+        ymax = numpy.amax(rows, axis=0, out=self._flat[:k])
+        self._ymax[columns] = ymax
+
+        flat = ymax
+        flat -= 1
+        flat *= k
+        flat += self._columns[:k]
+        self._column_z[columns] = numpy.take(zone, flat, mode='clip')
+
+    def _analyze_columns(self, band, start=0, stop=None):
+        '''Finds the borders of the columns start:stop of the band: lowest
+        row where Z is in range, and Z there.'''
+        columns = slice(start, stop)
+        index = self._index[:, columns]
+        zone = self.zone[:, columns]
+        mask = self._mask[:, columns]
+
+        # Only the zone from which Data is considered is converted to cm.
+        numpy.copyto(index, band[:, columns])
+        numpy.take(self._lut, index, out=zone, mode='clip')
+
+        # -- Extract borders (lower Y where Z is in range)
+
+        # ymax: for each x: maximum Y for the given X
+        # on the zone where Z is in range. Rows are numbered from 1 so that
+        # 0 tells an empty column.
+        numpy.less_equal(zone, self.MAX_DEPTH, out=mask)
+        if self.background is not None:
+            mask &= self._foreground[:, columns]
+        rows = index  # conversion indices are not needed anymore
+        rows.fill(0)
+        numpy.copyto(rows, self._row_numbers, where=mask)
+        ymax = self._ymax[columns]
+        numpy.amax(rows, axis=0, out=ymax)
+
+        # z@ymax, taken from the flat zone: row * bw + column. Empty columns
+        # get anything.
+        flat = self._flat[columns]
+        numpy.subtract(ymax, 1, out=flat)
+        flat *= self.band[2]
+        flat += self._columns[columns]
+        numpy.take(self.zone, flat, out=self._column_z[columns], mode='clip')
+
+    def _obstacles(self, provide_raw):
+        "Obstacles from the borders of all the columns."
+        bx, by, bw, bh = self.band
+
+        numpy.greater(self._ymax, 0, out=self._valid)
+        n = numpy.count_nonzero(self._valid)
+        if not n:
+            return []
+        x, y, z = self._x[:n], self._y[:n], self._z[:n]
+        numpy.compress(self._valid, self._ymax, out=y)
+        y += by - 1
+        numpy.compress(self._valid, self._column_z, out=z)
+        numpy.compress(self._valid, self._columns, out=x)
+        x += bx
+
+        # -- Analysis :
+
+        # Separate feet, and drop points too high above their base.
+        height = self._grid.y_to_cm(y, z, out=self._height[:n])
+        foot = self._foot[:n]
+        kept = self._kept[:n]
+        count = self._segment(x, z, height, foot, kept, self.MAX_Z_CHANGE,
+                              self.MAX_BORDER_HEIGHT)
+        start = self._start[:count]
+        start[0] = 0
+
+        m = numpy.count_nonzero(kept)
+        x = numpy.compress(kept, x, out=self._kept_x[:m])
+        y = numpy.compress(kept, y, out=self._kept_y[:m])
+        z = numpy.compress(kept, z, out=self._kept_z[:m])
+        foot = numpy.compress(kept, foot, out=self._kept_foot[:m])
+
+        # Every foot keeps at least its lowest point: feet start where the
+        # foot number changes, at point indices 1:m.
+        changed = self._new_foot[:m - 1]
+        numpy.not_equal(foot[1:], foot[:-1], out=changed)
+        numpy.compress(changed, self._columns[1:m], out=start[1:])
+
+        x_cm = self._grid.x_to_cm(x, z, out=self._x_cm[:m])
+        left = numpy.minimum.reduceat(x_cm, start, out=self._left[:count])
+        right = numpy.maximum.reduceat(x_cm, start, out=self._right[:count])
+
+        # z is already in cm
+        close = numpy.minimum.reduceat(z, start, out=self._close[:count])
+        far = numpy.maximum.reduceat(z, start, out=self._far[:count])
+
+        top = numpy.minimum.reduceat(y, start, out=self._top[:count])
+
+        if provide_raw:
+            # One array for the frame, obstacles get views into it.
+            raw_data = numpy.empty((m, 3), self.zone.dtype)
+            raw_data[:, 0] = x
+            raw_data[:, 1] = y
+            raw_data[:, 2] = z
+            ends = self._end[:count]
+            ends[:-1] = start[1:]
+            ends[-1] = m
+
+        # swap coordinates Y and Z here (y was height,
+        # becomes depth ; invert for z)
+        final = []
+        for i in xrange(count):
+            final.append(Obstacle(
+                x=left[i],
+                y=close[i],
+                width=right[i] - left[i],
+                height=far[i] - close[i],
+                z=top[i],
+                raw_data=raw_data[start[i]:ends[i]] if provide_raw else None
+            ))
+        return final
+
+
+class IncrementalDepthProcessor(DepthProcessor):
+    '''DepthProcessor that only analyzes what changed since the last
+    analyzed frame.
+
+    processor = IncrementalDepthProcessor(band=..., dtype=numpy.float32,
+                                          background=None, tolerance=0)
+        tolerance:  raw depth difference up to which a pixel is considered
+                    unchanged. With 0, results are the same as
+                    DepthProcessor's.
+
+    Call reset() after the background model learned new frames.
+
+    Columns of the band with a changed pixel are detected with a thresholded
+    difference to the last analyzed frame. If there are none, the previous
+    obstacles are returned, otherwise only the runs of changed columns are
+    analyzed again before feet are separated.
+    '''
+
+    def __init__(self, band=_DEFAULT_ANALYSIS_BAND, dtype=numpy.float32,
+                 background=None, tolerance=0, backend=None, coarse=None,
+                 coarse_margin=1):
+        DepthProcessor.__init__(self, band, dtype, background, backend,
+                                coarse, coarse_margin)
+        bx, by, bw, bh = band
+        self.tolerance = tolerance
+        self._current = numpy.empty((bh, bw), numpy.int32)
+        self._last = numpy.empty((bh, bw), numpy.int32)
+        self._difference = numpy.empty((bh, bw), numpy.int32)
+        self._changed = numpy.empty((bh, bw), bool)
+        self._changed_columns = numpy.empty(bw, bool)
+        self._cache = None  # (provide_raw, obstacles)
+
+        # Statistics.
+        self.frames = self.skipped_frames = self.analyzed_columns = 0
+
+    def reset(self):
+        "Forgets the last frame, the next one is fully analyzed."
+        self._cache = None
+
+    def extract_obstacles(self, depth, provide_raw=False):
+        '''Returns obstacles from pixel depth, full frame or already cropped
+        to the band. See extract_obstacles.'''
+        band = crop_band(depth, self.band)
+        self.frames += 1
+        numpy.copyto(self._current, band)
+
+        if self._cache is None:
+            runs = [(0, self.band[2])]
+        else:
+            difference = self._difference
+            numpy.subtract(self._current, self._last, out=difference)
+            numpy.absolute(difference, out=difference)
+            numpy.greater(difference, self.tolerance, out=self._changed)
+            numpy.any(self._changed, axis=0, out=self._changed_columns)
+            runs = self._runs(self._changed_columns)
+            if not runs:
+                self.skipped_frames += 1
+                cached_raw, obstacles = self._cache
+                if cached_raw == provide_raw:
+                    return list(obstacles)
+
+        for start, stop in runs:
+            self._analyze(band, start, stop)
+            self.analyzed_columns += stop - start
+            # Other columns keep the depth they were analyzed with.
+            self._last[:, start:stop] = self._current[:, start:stop]
+        obstacles = self._obstacles(provide_raw)
+        self._cache = provide_raw, obstacles
+        return list(obstacles)
+
+
+# Processors used by extract_obstacles, by thread then by band: a processor
+# must not be shared between threads.
+_PROCESSORS = threading.local()
+
+
 def extract_obstacles(
         depth,
         band=_DEFAULT_ANALYSIS_BAND,
@@ -151,7 +1193,7 @@ def extract_obstacles(
         provide_raw=False):
     '''Returns obstacles from pixel depth
     extract_obstacles(depth, band=..., surface=..., provide_raw=False):
-        depth:      depth array
+        depth:      depth array, full frame or already cropped to the band
         band:       an optional analysis band in pixels (x, y, w, h) and
         surface:    an optional analysis band in cm within the game area
                     (x, z, w, p) - in top view, z is depth
@@ -171,98 +1213,278 @@ def extract_obstacles(
                 ground
 
              raw_data: the raw data for analysis (x,y in pixels, z in cm)
+                       (n, 3) array, view into an array shared by the
+                       obstacles of the frame
     '''
-    MAX_DEPTH = 300.0  # 3 meters. FIXME Depends on Gaming Zone size.
-    MAX_BORDER_HEIGHT = 5  # cm. a foot can never be higher than this.
-                            # Restrict accordingly.
-    MAX_Z_CHANGE = 10  # cm. consider discutinued foot if Z varies this much or
-                       # more
+    band = tuple(band)
+    try:
+        processors = _PROCESSORS.by_band
+    except AttributeError:
+        processors = _PROCESSORS.by_band = {}
+    try:
+        processor = processors[band]
+    except KeyError:
+        processor = processors.setdefault(
+                band, DepthProcessor(band, dtype=numpy.float64))
+    return processor.extract_obstacles(depth, provide_raw)
 
-    dist = z_to_cm(depth)
 
-    # -- Extract borders (lower Y where Z is in range)
-    bx, by, bw, bh = band
+# ----------------------------------------------
+# Tracking.
 
-    borders = []     # list of (x, ymax, z@ymax) of non-empty columns. ymax :
-                     # max Y where z is not null
-                     # x,y in pixels ; z in cm
-
-    zone = dist[by:by + bh, bx:bx + bw]   # extract zone from which Data
-                                         # is considered
-
-    # ymax: for each x: maximum Y for the given X
-    # on the zone where Z is in range
-    for x in xrange(zone.shape[1]):
-        non_null_y = numpy.argwhere(zone[:, x] <= MAX_DEPTH)  # y in range ?
-        if non_null_y.size:  # is there any z in the range ?
-            ymax = numpy.max(non_null_y)
-            # split to new if discontinuity (y ou z) ?
-            borders.append((bx + x, by + ymax, zone[ymax, x]))
-        # else: new foot
-
-    # -- Analysis :
-
-    # Analyze from the borders array the list of feets
-
-    feet = []  # foot : (x,y,z) points in the foot, one per X
-    x, _, z = borders[0]  # initialization
-    prev_x = x
-    prev_z = z
-    foot = []  # current foot
-    for x, y, z in borders:
-        # Separate disconnected feet.
-        # connected foot : contiguous X and not too abrupt z change
-        if x - prev_x <= 1 and abs(prev_z - z) < MAX_Z_CHANGE:
-            foot.append((x, y, z))
-        else:
-            feet.append(foot)
-            foot = [(x, y, z)]
-        prev_x = x
-        prev_z = z
-
-    if foot:
-        feet.append(foot)
-
-    # Limit zone height : distance between base and top must be restricted.
-    # shrink foot accordingly (...)
-    # put back results to feet
-    result = []
-    for foot in feet:
-        m = min(y_to_cm(y, z) for x, y, z in foot)  # bas du pied actuel,
-                                                    # including corresponding z
-        result.append([(x, y, z) for x, y, z in foot
-            if y_to_cm(y, z) - m <= MAX_BORDER_HEIGHT])
-    feet = result
-
-    final = []
-    for foot in feet:
-        left = min(x_to_cm(x, z) for x, y, z in foot)
-        right = max(x_to_cm(x, z) for x, y, z in foot)
+# Returned by ObstacleTracker.
+#
+# id            Identifier of the foot, stable across frames. Int
+# x, y          Center of the foot in top view, in cm (same axes as Obstacle)
+# vx, vy        Velocity, in cm per second
+# obstacle      Last Obstacle associated with the foot
+# missed        Number of frames since the foot was last detected
+Track = namedtuple('Track', 'id x y vx vy obstacle missed')
 
-        # z is already in cm
-        close = min(z for x, y, z in foot)
-        far = max(z for x, y, z in foot)
 
-        bottom = min(y_to_cm(y, z) for x, y, z in foot)
+class ObstacleTracker(object):
+    '''Follows obstacles across frames.
 
-        # swap coordinates Y and Z here (y was height,
-        # becomes depth ; invert for z)
-        final.append(Obstacle(
-            x=left,
-            y=close,
-            width=right - left,
-            height=far - close,
-            z=min(y for x, y, z in foot),
-            raw_data=foot if provide_raw else None
-        ))
-    return final
+    tracker = ObstacleTracker(gate=30.0, max_missed=3, alpha=0.85, beta=0.6)
+        gate:       maximal distance in cm between the predicted position of
+                    a foot and a detection associated with it
+        max_missed: frames a foot may be undetected before it is dropped
+        alpha, beta: gains of the alpha-beta (steady state Kalman) filter on
+                    positions and velocities
+
+    update(obstacles, timestamp) associates detections to known feet, then
+    predict(timestamp) extrapolates their positions at any time, e.g. at
+    render rate between two depth frames.
+    '''
+
+    MAX_PREDICTION = 0.2  # s. Do not extrapolate further than this.
+    MIN_VELOCITY_DT = 0.01  # s. Velocities are not updated closer than this.
+
+    def __init__(self, gate=30.0, max_missed=3, alpha=0.85, beta=0.6):
+        self.gate = gate
+        self.max_missed = max_missed
+        self.alpha = alpha
+        self.beta = beta
+        self._next_id = 0
+        self._ids = numpy.zeros(0, int)
+        self._position = numpy.zeros((0, 2))
+        self._velocity = numpy.zeros((0, 2))
+        self._missed = numpy.zeros(0, int)
+        self._obstacles = []
+        self._timestamp = None
+
+    def update(self, obstacles, timestamp=None):
+        "Takes the obstacles of a new frame, returns the current tracks."
+        if timestamp is None:
+            timestamp = time.time()
+        # Same clamping as predict: a pause does not throw feet away.
+        dt = 0.0 if self._timestamp is None else timestamp - self._timestamp
+        dt = min(max(dt, 0.0), self.MAX_PREDICTION)
+        self._timestamp = timestamp
+
+        detected = numpy.array(
+            [(o.x + o.width / 2.0, o.y + o.height / 2.0) for o in obstacles],
+            float).reshape(-1, 2)
+        predicted = self._position + self._velocity * dt
+
+        # Cost matrix: distances between predicted feet and detections.
+        cost = numpy.sqrt(((predicted[:, None, :] - detected[None, :, :])
+                           ** 2).sum(axis=2))
+
+        # Greedy association, closest pairs first, within the gate.
+        track_of = numpy.empty(len(detected), int)
+        track_of.fill(-1)
+        matched = numpy.zeros(len(predicted), bool)
+        tracks, detections = numpy.unravel_index(numpy.argsort(cost, None),
+                                                 cost.shape)
+        for t, d in zip(tracks, detections):
+            if cost[t, d] > self.gate:
+                break
+            if not matched[t] and track_of[d] < 0:
+                matched[t] = True
+                track_of[d] = t
+
+        # Alpha-beta filter on associated feet.
+        found = track_of >= 0
+        t = track_of[found]
+        residual = detected[found] - predicted[t]
+        position = predicted.copy()
+        velocity = self._velocity.copy()
+        position[t] += self.alpha * residual
+        if dt >= self.MIN_VELOCITY_DT:
+            velocity[t] += self.beta / dt * residual
+        missed = self._missed + 1
+        missed[t] = 0
+        obstacles_of = list(self._obstacles)
+        for d in numpy.flatnonzero(found):
+            obstacles_of[track_of[d]] = obstacles[d]
+
+        # Forget feet lost for too long, add new ones.
+        kept = missed <= self.max_missed
+        new = numpy.flatnonzero(~found)
+        new_ids = numpy.arange(self._next_id, self._next_id + len(new))
+        self._next_id += len(new)
+        self._ids = numpy.concatenate((self._ids[kept], new_ids))
+        self._position = numpy.concatenate((position[kept], detected[new]))
+        self._velocity = numpy.concatenate(
+            (velocity[kept], numpy.zeros((len(new), 2))))
+        self._missed = numpy.concatenate((missed[kept],
+                                          numpy.zeros(len(new), int)))
+        self._obstacles = [o for o, k in zip(obstacles_of, kept) if k] \
+                + [obstacles[d] for d in new]
+        return self.tracks()
+
+    def tracks(self):
+        "Current tracks, as of the last update."
+        return self._tracks(self._position)
+
+    def predict(self, timestamp=None):
+        '''Tracks with positions extrapolated at timestamp (now by default),
+        at most MAX_PREDICTION seconds after the last update.'''
+        if self._timestamp is None:
+            return []
+        if timestamp is None:
+            timestamp = time.time()
+        dt = min(max(timestamp - self._timestamp, 0.0), self.MAX_PREDICTION)
+        return self._tracks(self._position + self._velocity * dt)
+
+    def _tracks(self, position):
+        return [Track(id=int(i), x=x, y=y, vx=vx, vy=vy, obstacle=o,
+                      missed=int(m))
+                for i, (x, y), (vx, vy), o, m in zip(
+                    self._ids, position, self._velocity, self._obstacles,
+                    self._missed)]
+
+
+# ----------------------------------------------
+# Obstacle events.
+
+# Kinds of ObstacleEvent.
+FOOT_ENTERED = 'entered'
+FOOT_MOVED = 'moved'
+FOOT_LEFT = 'left'
+
+# Published by ObstacleEvents.
+#
+# kind          FOOT_ENTERED, FOOT_MOVED or FOOT_LEFT
+# id            Track identifier of the foot
+# x, y          Center of the foot in top view, in cm. Last known position
+#               when the foot left
+# dx, dy        Move since the previous event of the foot, in cm
+# obstacle      Last Obstacle of the foot
+# timestamp     Time of the frame
+ObstacleEvent = namedtuple('ObstacleEvent',
+                           'kind id x y dx dy obstacle timestamp')
+
+
+def _in_region(x, y, region):
+    x0, y0, x1, y1 = region
+    return x0 <= x < x1 and y0 <= y < y1
+
+
+class ObstacleEvents(object):
+    '''Publishes the changes of the obstacles of successive frames.
+
+    events = ObstacleEvents(tracker=None, min_move=1.0)
+        tracker:    ObstacleTracker giving feet their identity, a new one by
+                    default
+        min_move:   moves shorter than this, in cm, are not published. They
+                    add up until they are.
+
+    update(obstacles) publishes to subscribers, see subscribe, an event for
+    each foot that entered, moved or left since the previous frame.
+
+    Feet leave once the tracker drops them, after its max_missed frames. To
+    follow exactly the feet of the last frame, e.g. for display, use
+    ObstacleTracker(max_missed=0) and min_move=0.0.
+    '''
+
+    def __init__(self, tracker=None, min_move=1.0):
+        self.tracker = tracker if tracker is not None else ObstacleTracker()
+        self.min_move = min_move
+        self._feet = {}  # id: (x, y, obstacle) as last published
+        self._subscribers = []
+        self._next_token = 0
+
+    def subscribe(self, callback, kinds=None, region=None):
+        '''Calls callback(event) for each event. Returns a token for
+        unsubscribe.
+            kinds:      kinds of events wanted, all by default
+            region:     if given (x0, y0, x1, y1) in cm, top view, only feet
+                        in the region are seen: feet moving in and out of
+                        it are published as entering and leaving.
+        '''
+        token = self._next_token
+        self._next_token += 1
+        self._subscribers.append((token, callback, kinds, region))
+        return token
+
+    def unsubscribe(self, token):
+        self._subscribers = [s for s in self._subscribers if s[0] != token]
+
+    def update(self, obstacles, timestamp=None):
+        '''Takes the obstacles of a new frame, publishes and returns its
+        events.'''
+        if timestamp is None:
+            timestamp = time.time()
+        events = []
+        tracks = self.tracker.update(obstacles, timestamp)
+        for track in tracks:
+            foot = self._feet.get(track.id)
+            if foot is None:
+                kind, dx, dy = FOOT_ENTERED, 0.0, 0.0
+            elif track.missed:
+                continue
+            else:
+                kind, dx, dy = FOOT_MOVED, track.x - foot[0], track.y - foot[1]
+                if dx * dx + dy * dy < self.min_move * self.min_move:
+                    # Not published, but the obstacle is the detected one.
+                    self._feet[track.id] = foot[0], foot[1], track.obstacle
+                    continue
+            events.append(ObstacleEvent(kind, track.id, track.x, track.y,
+                                        dx, dy, track.obstacle, timestamp))
+            self._feet[track.id] = track.x, track.y, track.obstacle
+
+        ids = set(track.id for track in tracks)
+        for i in sorted(set(self._feet) - ids):
+            x, y, obstacle = self._feet.pop(i)
+            events.append(ObstacleEvent(FOOT_LEFT, i, x, y, 0.0, 0.0,
+                                        obstacle, timestamp))
+
+        for token, callback, kinds, region in list(self._subscribers):
+            for event in events:
+                if region is not None:
+                    event = self._in_region(event, region)
+                if event is not None and (kinds is None
+                                          or event.kind in kinds):
+                    callback(event)
+        return events
+
+    @property
+    def feet(self):
+        '''Feet that entered and did not leave, as a dict id: Obstacle,
+        with their last detected obstacle.'''
+        return dict((i, foot[2]) for i, foot in self._feet.iteritems())
+
+    def _in_region(self, event, region):
+        "event as seen from a region, None if not seen"
+        inside = _in_region(event.x, event.y, region)
+        if event.kind != FOOT_MOVED:
+            return event if inside else None
+        was_inside = _in_region(event.x - event.dx, event.y - event.dy,
+                                region)
+        if inside and not was_inside:
+            return event._replace(kind=FOOT_ENTERED)
+        if was_inside and not inside:
+            return event._replace(kind=FOOT_LEFT)
+        return event if inside else None
 
 
 def get_obstacles(provide_raw=False):
     """Get buffers from the Kinect and extract obstacles.
 
     See extract_obstacles for obstacle definition."""
-    k = get_buffers()
+    k = get_buffers(streams=(DEPTH_STREAM,))
     if not k.real_kinect:
         print "Using Fake Data..."
     return extract_obstacles(k.depth, provide_raw=provide_raw)
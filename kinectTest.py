@@ -0,0 +1,775 @@
+import threading
+import unittest
+import numpy
+import kinect
+
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+
+def load_depths():
+    return [numpy.load(f + '_depth.npy') for f in DATA_FILES]
+
+
+class ExtractObstaclesTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = load_depths()
+
+    def test_same_as_reference(self):
+        for depth in self.depths:
+            expected = reference_extract_obstacles(depth)
+            found = kinect.extract_obstacles(depth, provide_raw=True)
+            self.assertEqual(len(found), len(expected))
+            for obstacle, (x, y, w, h, z, raw) in zip(found, expected):
+                self.assertEqual(tuple(obstacle[:5]), (x, y, w, h, z))
+                self.assertEqual([tuple(p) for p in obstacle.raw_data], raw)
+
+    def test_no_raw_data(self):
+        for obstacle in kinect.extract_obstacles(self.depths[0]):
+            self.assertTrue(obstacle.raw_data is None)
+
+    def test_empty_band(self):
+        depth = numpy.empty((480, 640), dtype=numpy.uint16)
+        depth.fill(kinect.UNDEF_DEPTH)
+        self.assertEqual(kinect.extract_obstacles(depth), [])
+
+    def test_threads(self):
+        expected = [[tuple(o[:5]) for o in kinect.extract_obstacles(depth)]
+                    for depth in self.depths]
+        errors = []
+
+        def extract(offset):
+            for i in xrange(100):
+                k = (i + offset) % len(self.depths)
+                found = kinect.extract_obstacles(self.depths[k])
+                if [tuple(o[:5]) for o in found] != expected[k]:
+                    errors.append(k)
+
+        threads = [threading.Thread(target=extract, args=(offset,))
+                   for offset in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class FrameGrabberTest (unittest.TestCase):
+
+    def setUp(self):
+        self.grabber = kinect.FrameGrabber(
+            kinect.FakeDevice(DATA_FILES, rate=200.0)).start()
+
+    def tearDown(self):
+        self.grabber.stop()
+
+    def test_next_frame(self):
+        first = self.grabber.next_frame(timeout=1.0)
+        second = self.grabber.next_frame(after=first.index, timeout=1.0)
+        self.assertFalse(first.real_kinect)
+        self.assertTrue(second.index > first.index)
+        self.assertTrue(second.timestamp >= first.timestamp)
+        self.assertEqual(second.depth.shape, (480, 640))
+        self.assertEqual(second.rgb.shape, (480, 640, 3))
+
+    def test_replayed_data(self):
+        depths = load_depths()
+        frame = self.grabber.next_frame(timeout=1.0)
+        matching = [i for i, depth in enumerate(depths)
+                    if (depth == frame.depth).all()]
+        self.assertEqual(len(matching), 1)
+
+    def test_latest(self):
+        frame = self.grabber.next_frame(timeout=1.0)
+        latest = self.grabber.latest()
+        self.assertTrue(latest.index >= frame.index)
+
+    def test_stopped(self):
+        self.grabber.stop()
+        self.assertFalse(self.grabber.is_running())
+        self.assertTrue(self.grabber.next_frame(timeout=1.0) is None)
+
+    def test_get_buffers(self):
+        grabber = kinect.start_acquisition(kinect.FakeDevice(DATA_FILES[1:2]))
+        try:
+            grabber.next_frame(timeout=1.0)
+            data = kinect.get_buffers()
+            self.assertFalse(data.real_kinect)
+            self.assertTrue((data.depth == load_depths()[1]).all())
+        finally:
+            kinect.stop_acquisition()
+
+
+class StreamsTest (unittest.TestCase):
+
+    def test_depth_only_buffers(self):
+        data = kinect.get_buffers(streams=(kinect.DEPTH_STREAM,))
+        self.assertTrue(data.rgb is None)
+        self.assertEqual(data.depth.shape, (480, 640))
+
+    def test_rgb_only_buffers(self):
+        data = kinect.get_buffers(streams=(kinect.RGB_STREAM,))
+        self.assertTrue(data.depth is None)
+        self.assertEqual(data.rgb.shape, (480, 640, 3))
+
+    def test_depth_only_grabber(self):
+        grabber = kinect.FrameGrabber(kinect.FakeDevice(DATA_FILES, 200.0),
+                                      streams=(kinect.DEPTH_STREAM,)).start()
+        try:
+            frame = grabber.next_frame(timeout=1.0)
+            self.assertTrue(frame.rgb is None)
+            self.assertEqual(frame.depth.shape, (480, 640))
+        finally:
+            grabber.stop()
+
+
+class BandTest (unittest.TestCase):
+
+    def test_cropped_depth(self):
+        for depth in load_depths():
+            band = kinect.crop_band(depth).copy()
+            self.assertEqual(band.shape, (85, 566))
+            self.assertEqual(kinect.extract_obstacles(band),
+                             kinect.extract_obstacles(depth))
+
+    def test_z_to_cm_out(self):
+        depth = load_depths()[0]
+        out = numpy.empty(depth.shape)
+        self.assertTrue(kinect.z_to_cm(depth, out=out) is out)
+        self.assertTrue((out == kinect.z_to_cm(depth)).all())
+
+    def test_grabber_band(self):
+        band = (37, 196, 566, 85)
+        grabber = kinect.FrameGrabber(kinect.FakeDevice(DATA_FILES[:1], 200.0),
+                                      streams=(kinect.DEPTH_STREAM,),
+                                      band=band).start()
+        try:
+            frame = grabber.next_frame(timeout=1.0)
+            self.assertTrue((frame.depth
+                             == kinect.crop_band(load_depths()[0])).all())
+        finally:
+            grabber.stop()
+
+
+class DepthProcessorTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = load_depths()
+        self.processor = kinect.DepthProcessor()
+
+    def test_float32_close_to_reference(self):
+        for depth in self.depths:
+            found = self.processor.extract_obstacles(depth)
+            expected = kinect.extract_obstacles(depth)
+            self.assertEqual(len(found), len(expected))
+            for obstacle, reference in zip(found, expected):
+                for value, expected_value in zip(obstacle[:5], reference[:5]):
+                    self.assertTrue(are_nearly_equal(value, expected_value))
+
+    def test_buffers_reused(self):
+        zone = self.processor.zone
+        for depth in self.depths:
+            self.processor.extract_obstacles(depth)
+        self.assertTrue(self.processor.zone is zone)
+        self.assertEqual(zone.dtype, numpy.float32)
+        self.assertEqual(zone.shape, (85, 566))
+
+    def buffers(self, processor):
+        "Work arrays of a processor and its kernel, by name"
+        buffers = {}
+        for owner in (processor, processor._segment):
+            for name, value in vars(owner).items():
+                if isinstance(value, numpy.ndarray):
+                    buffers[owner, name] = (
+                        value, value.__array_interface__['data'][0])
+        return buffers
+
+    def test_steady_state(self):
+        # Steady state frames work in the buffers of the first one.
+        for backend in kinect.SEGMENTATION_BACKENDS:
+            processor = kinect.DepthProcessor(backend=backend)
+            depth = self.depths[3]
+            first = processor.extract_obstacles(depth, provide_raw=True)
+            before = self.buffers(processor)
+            second = processor.extract_obstacles(depth, provide_raw=True)
+            after = self.buffers(processor)
+            self.assertEqual(sorted(before), sorted(after))
+            for key, (array, address) in before.items():
+                self.assertTrue(after[key][0] is array, key[1])
+                self.assertEqual(after[key][1], address, key[1])
+            self.assertEqual([o[:5] for o in first], [o[:5] for o in second])
+            for obstacle, reference in zip(first, second):
+                self.assertTrue((obstacle.raw_data
+                                 == reference.raw_data).all())
+
+
+class CoordinateGridTest (unittest.TestCase):
+
+    def test_full_frame(self):
+        depth = load_depths()[0]
+        x, y, z = kinect.coordinate_grid().to_world(depth)
+        rows, columns = numpy.indices(depth.shape)
+        self.assertTrue((z == kinect.z_to_cm(depth)).all())
+        self.assertTrue((x == kinect.x_to_cm(columns, z)).all())
+        self.assertTrue((y == kinect.y_to_cm(rows, z)).all())
+
+    def test_band(self):
+        band = (37, 196, 566, 85)
+        depth = load_depths()[1]
+        full = kinect.coordinate_grid().to_world(depth)
+        cropped = kinect.coordinate_grid(band).to_world(depth)
+        for full_values, band_values in zip(full, cropped):
+            self.assertTrue(
+                (kinect.crop_band(full_values, band) == band_values).all())
+
+    def test_points(self):
+        grid = kinect.coordinate_grid()
+        x = numpy.array([0, 320, 639])
+        z = numpy.array([100.0, 200.0, 300.0])
+        self.assertEqual(list(grid.x_to_cm(x, z)), list(kinect.x_to_cm(x, z)))
+        self.assertEqual(list(grid.y_to_cm(x[:2], z[:2])),
+                         list(kinect.y_to_cm(x[:2], z[:2])))
+
+    def test_cached(self):
+        self.assertTrue(kinect.coordinate_grid((1, 2, 3, 4))
+                        is kinect.coordinate_grid([1, 2, 3, 4]))
+
+
+class PointCloudTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depth = load_depths()[2]
+
+    def test_full_frame(self):
+        cloud = kinect.to_point_cloud(self.depth)
+        z = kinect.z_to_cm(self.depth)
+        rows, columns = numpy.nonzero(z != kinect.UNDEF_DISTANCE)
+        self.assertEqual(cloud.shape, (rows.size, 3))
+        self.assertEqual(cloud.dtype, numpy.float32)
+        self.assertTrue(cloud.flags.c_contiguous)
+        z = z[rows, columns]
+        for i in (0, rows.size // 2, -1):
+            self.assertTrue(are_nearly_equal(
+                cloud[i, 0], kinect.x_to_cm(columns[i], z[i])))
+            self.assertTrue(are_nearly_equal(
+                cloud[i, 1], kinect.y_to_cm(rows[i], z[i])))
+            self.assertTrue(are_nearly_equal(cloud[i, 2], z[i]))
+
+    def test_band_and_stride(self):
+        band = (37, 196, 566, 85)
+        cloud = kinect.to_point_cloud(self.depth, band)
+        strided = kinect.to_point_cloud(self.depth, band, stride=2)
+        self.assertTrue(0 < len(strided) < len(cloud) / 3)
+        self.assertTrue(numpy.isin(strided[:, 2], cloud[:, 2]).all())
+
+    def test_raw_data_views(self):
+        obstacles = kinect.extract_obstacles(self.depth, provide_raw=True)
+        base = obstacles[0].raw_data.base
+        for obstacle in obstacles:
+            self.assertEqual(obstacle.raw_data.shape[1], 3)
+            self.assertTrue(obstacle.raw_data.base is base)
+        self.assertTrue('has raw data' in str(obstacles[0]))
+
+
+class ObstacleTrackerTest (unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = kinect.ObstacleTracker()
+
+    def feet(self, *positions):
+        return [kinect.Obstacle(x=x - 5, y=y - 10, width=10, height=20, z=0,
+                                raw_data=None) for x, y in positions]
+
+    def test_stable_ids(self):
+        first = self.tracker.update(self.feet((0, 200), (50, 150)), 0.0)
+        second = self.tracker.update(self.feet((52, 151), (1, 202)), 0.1)
+        ids = dict((track.obstacle.x, track.id) for track in second)
+        self.assertEqual(ids[47], first[1].id)
+        self.assertEqual(ids[-4], first[0].id)
+
+    def test_velocity_and_prediction(self):
+        for i in xrange(10):
+            tracks = self.tracker.update(self.feet((10 * i, 200)), i / 10.0)
+        self.assertEqual(len(tracks), 1)
+        self.assertTrue(are_nearly_equal(tracks[0].vx, 100.0, 1.0))
+        self.assertTrue(are_nearly_equal(tracks[0].vy, 0.0, 1.0))
+        predicted = self.tracker.predict(0.95)[0]
+        self.assertTrue(are_nearly_equal(predicted.x, 95.0, 1.0))
+        # Extrapolation is bounded.
+        far = self.tracker.predict(100.0)[0]
+        self.assertTrue(are_nearly_equal(far.x, 110.0, 1.0))
+
+    def test_new_and_lost(self):
+        first = self.tracker.update(self.feet((0, 200)), 0.0)
+        tracks = self.tracker.update(self.feet((100, 200)), 0.1)
+        self.assertEqual(len(tracks), 2)
+        self.assertEqual(tracks[0].missed, 1)
+        self.assertNotEqual(tracks[1].id, first[0].id)
+        for i in xrange(3):
+            tracks = self.tracker.update(self.feet((100, 200)),
+                                         0.2 + i / 10.0)
+        self.assertEqual([track.id for track in tracks], [tracks[0].id])
+        self.assertEqual(tracks[0].obstacle.x, 95)
+
+    def test_pause(self):
+        for i in xrange(10):
+            tracks = self.tracker.update(self.feet((10 * i, 200)), i / 10.0)
+        # Same position long after: the foot is not extrapolated away.
+        after = self.tracker.update(self.feet((90, 200)), 5.5)
+        self.assertEqual([(t.id, t.missed) for t in after],
+                         [(tracks[0].id, 0)])
+
+    def test_tiny_dt(self):
+        for i in xrange(10):
+            tracks = self.tracker.update(self.feet((10 * i, 200)), i / 10.0)
+        after = self.tracker.update(self.feet((91, 200)), 0.9001)[0]
+        self.assertEqual((after.vx, after.vy), (tracks[0].vx, tracks[0].vy))
+
+    def test_recorded_frames(self):
+        obstacles = kinect.extract_obstacles(load_depths()[3])
+        first = self.tracker.update(obstacles, 0.0)
+        second = self.tracker.update(obstacles, 0.033)
+        self.assertEqual(len(first), len(obstacles))
+        self.assertEqual([t.id for t in first], [t.id for t in second])
+        for track in second:
+            self.assertEqual((track.vx, track.vy), (0.0, 0.0))
+
+
+class ObstacleEventsTest (unittest.TestCase):
+
+    def setUp(self):
+        self.events = kinect.ObstacleEvents()
+        self.received = []
+
+    def feet(self, *positions):
+        return [kinect.Obstacle(x=x - 5, y=y - 10, width=10, height=20, z=0,
+                                raw_data=None) for x, y in positions]
+
+    def kinds(self, events):
+        return [(e.kind, e.x, e.y) for e in events]
+
+    def test_enter_move_leave(self):
+        self.events.subscribe(self.received.append)
+        first = self.events.update(self.feet((0, 200)), 0.0)
+        self.assertEqual(self.kinds(first), [(kinect.FOOT_ENTERED, 0, 200)])
+        foot = first[0].id
+
+        # Not far enough to be published, moves add up.
+        self.assertEqual(self.events.update(self.feet((0.5, 200)), 0.1), [])
+        moved = self.events.update(self.feet((5, 200)), 0.2)
+        self.assertEqual(len(moved), 1)
+        self.assertEqual((moved[0].kind, moved[0].id),
+                         (kinect.FOOT_MOVED, foot))
+        self.assertTrue(are_nearly_equal(moved[0].dx, moved[0].x, 0.01))
+        self.assertEqual(moved[0].dy, 0.0)
+
+        # Lost feet leave once the tracker drops them.
+        for i in xrange(3):
+            self.assertEqual(self.events.update([], 0.3 + i / 10.0), [])
+        left = self.events.update([], 0.6)
+        self.assertEqual([(e.kind, e.id) for e in left],
+                         [(kinect.FOOT_LEFT, foot)])
+        self.assertEqual(left[0].x, moved[0].x)
+        self.assertEqual(self.received, first + moved + left)
+
+    def test_kinds(self):
+        self.events.subscribe(self.received.append,
+                              kinds=(kinect.FOOT_ENTERED,))
+        self.events.update(self.feet((0, 200)), 0.0)
+        self.events.update(self.feet((10, 200), (100, 150)), 0.1)
+        self.assertEqual(self.kinds(self.received),
+                         [(kinect.FOOT_ENTERED, 0, 200),
+                          (kinect.FOOT_ENTERED, 100, 150)])
+
+    def test_region(self):
+        self.events.subscribe(self.received.append,
+                              region=(-20.0, 180.0, 20.0, 220.0))
+        self.events.update(self.feet((0, 200), (100, 150)), 0.0)
+        self.events.update(self.feet((10, 200), (100, 160)), 0.1)
+        self.events.update(self.feet((30, 200), (100, 170)), 0.2)
+        self.assertEqual([e.kind for e in self.received],
+                         [kinect.FOOT_ENTERED, kinect.FOOT_MOVED,
+                          kinect.FOOT_LEFT])
+        self.assertEqual(len(set(e.id for e in self.received)), 1)
+
+    def test_unsubscribe(self):
+        token = self.events.subscribe(self.received.append)
+        self.events.update(self.feet((0, 200)), 0.0)
+        self.events.unsubscribe(token)
+        self.events.update(self.feet((50, 200)), 0.1)
+        self.assertEqual(len(self.received), 1)
+
+    def test_feet(self):
+        first = self.events.update(self.feet((0, 200)), 0.0)
+        moved = kinect.Obstacle(x=-5.5, y=190, width=12, height=20, z=0,
+                                raw_data=None)
+        self.assertEqual(self.events.update([moved], 0.1), [])
+        self.assertEqual(self.events.feet, {first[0].id: moved})
+
+    def test_switching_frames(self):
+        # As displayed: exactly the feet of the last frame.
+        events = kinect.ObstacleEvents(kinect.ObstacleTracker(max_missed=0),
+                                       min_move=0.0)
+        shown = {}
+
+        def show(event):
+            if event.kind == kinect.FOOT_LEFT:
+                del shown[event.id]
+            else:
+                shown[event.id] = event.obstacle
+
+        events.subscribe(show)
+        depths = load_depths()
+        for i, k in enumerate((3, 0, 1, 1)):
+            obstacles = kinect.extract_obstacles(depths[k])
+            events.update(obstacles, i / 30.0)
+            for feet in (shown, events.feet):
+                self.assertEqual(sorted(map(id, feet.values())),
+                                 sorted(map(id, obstacles)))
+
+    def test_recorded_frames(self):
+        obstacles = kinect.extract_obstacles(load_depths()[3])
+        entered = self.events.update(obstacles, 0.0)
+        self.assertEqual(len(entered), len(obstacles))
+        self.assertEqual(self.events.update(obstacles, 0.033), [])
+
+
+class IncrementalDepthProcessorTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = load_depths()
+        self.processor = kinect.IncrementalDepthProcessor()
+        self.reference = kinect.DepthProcessor()
+
+    def test_static_scene(self):
+        depth = self.depths[0]
+        first = self.processor.extract_obstacles(depth)
+        second = self.processor.extract_obstacles(depth.copy())
+        self.assertEqual(first, second)
+        self.assertEqual(self.processor.skipped_frames, 1)
+        self.assertEqual(self.processor.analyzed_columns, 566)
+
+    def test_same_results(self):
+        # Recorded frames, and partial changes between them.
+        frames = []
+        for depth, following in zip(self.depths, self.depths[1:]):
+            mixed = depth.copy()
+            mixed[:, 300:420] = following[:, 300:420]
+            frames += [depth, mixed, mixed]
+        for depth in frames:
+            found = self.processor.extract_obstacles(depth, provide_raw=True)
+            expected = self.reference.extract_obstacles(depth,
+                                                        provide_raw=True)
+            self.assertEqual([o[:5] for o in found],
+                             [o[:5] for o in expected])
+            for obstacle, reference in zip(found, expected):
+                self.assertTrue((obstacle.raw_data
+                                 == reference.raw_data).all())
+        self.assertTrue(self.processor.analyzed_columns < 566 * len(frames))
+
+    def test_changed_span(self):
+        depth = self.depths[1]
+        self.processor.extract_obstacles(depth)
+        changed = depth.copy()
+        changed[200:210, 100:110] = 800
+        self.processor.extract_obstacles(changed)
+        self.assertEqual(self.processor.analyzed_columns, 566 + 10)
+
+    def test_changed_runs(self):
+        # Changes at both ends of the band: only their columns are analyzed.
+        depth = self.depths[1]
+        self.processor.extract_obstacles(depth)
+        changed = depth.copy()
+        changed[200:210, 40:50] = 800
+        changed[200:210, 590:600] = 800
+        found = self.processor.extract_obstacles(changed)
+        self.assertEqual(self.processor.analyzed_columns, 566 + 20)
+        self.assertEqual(found, self.reference.extract_obstacles(changed))
+
+    def test_tolerance(self):
+        processor = kinect.IncrementalDepthProcessor(tolerance=2)
+        depth = self.depths[2]
+        processor.extract_obstacles(depth)
+        noisy = depth + (numpy.arange(depth.size) % 3).reshape(depth.shape)
+        processor.extract_obstacles(noisy.astype(numpy.uint16))
+        self.assertEqual(processor.skipped_frames, 1)
+
+
+class BackgroundModelTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = load_depths()
+        self.model = kinect.BackgroundModel(frames=3)
+
+    def test_median(self):
+        depth = numpy.minimum(self.depths[0], 2000)
+        for offset in (0, 10, 2):
+            self.model.learn(depth + offset)
+        self.assertEqual(len(self.model), 3)
+        self.assertEqual(self.model.depth.dtype, numpy.uint16)
+        self.assertTrue((self.model.depth
+                         == kinect.crop_band(depth) + 2).all())
+
+    def test_not_learned(self):
+        processor = kinect.DepthProcessor(background=self.model)
+        reference = kinect.DepthProcessor()
+        for depth in self.depths:
+            self.assertEqual(processor.extract_obstacles(depth),
+                             reference.extract_obstacles(depth))
+
+    def test_static_scene(self):
+        depth = self.depths[3]
+        self.model.learn(depth)
+        self.assertFalse(self.model.foreground(depth).any())
+        processor = kinect.DepthProcessor(background=self.model)
+        self.assertEqual(processor.extract_obstacles(depth), [])
+
+    def test_foreground_only(self):
+        background, scene = self.depths[3], self.depths[3].copy()
+        # A foot at 150 cm, in front of the background.
+        raw = numpy.searchsorted(kinect._dist_values[:1096], 150.0)
+        scene[230:260, 480:500] = raw
+        self.model.learn(background)
+        processor = kinect.IncrementalDepthProcessor(background=self.model)
+        obstacles = processor.extract_obstacles(scene, provide_raw=True)
+        self.assertEqual(len(obstacles), 1)
+        columns = obstacles[0].raw_data[:, 0]
+        self.assertTrue(480 <= columns.min() and columns.max() < 500)
+        self.assertTrue(are_nearly_equal(obstacles[0].y, 150.0, 1.0))
+
+    def test_undefined_background(self):
+        # No sensor return in the band, then a foot at 150 cm.
+        background = self.depths[3].copy()
+        kinect.crop_band(background)[:] = kinect.UNDEF_DEPTH
+        scene = background.copy()
+        raw = numpy.searchsorted(kinect._dist_values[:1096], 150.0)
+        scene[230:260, 480:500] = raw
+        self.model.learn(background)
+        self.assertTrue((self.model.limit == kinect.UNDEF_DEPTH).all())
+        processor = kinect.DepthProcessor(background=self.model)
+        self.assertEqual(processor.extract_obstacles(scene),
+                         kinect.DepthProcessor().extract_obstacles(scene))
+        self.assertEqual(len(processor.extract_obstacles(scene)), 1)
+
+    def test_flickering_median(self):
+        model = kinect.BackgroundModel(frames=4)
+        depth = numpy.zeros(self.depths[0].shape, numpy.uint16) + 700
+        for value in (kinect.UNDEF_DEPTH, 700, kinect.UNDEF_DEPTH, 710):
+            depth[240, 320] = value
+            model.learn(depth)
+        self.assertEqual(model.depth[0, 0], 700)
+        band_x, band_y = kinect._DEFAULT_ANALYSIS_BAND[:2]
+        self.assertEqual(model.depth[240 - band_y, 320 - band_x], 700)
+
+
+class OccupancyGridTest (unittest.TestCase):
+
+    def test_counts(self):
+        grid = kinect.OccupancyGrid(area=(-10.0, 100.0, 10.0, 120.0),
+                                    resolution=2.0)
+        self.assertEqual(grid.shape, (10, 10))
+        cloud = numpy.array([[-10.0, 0.0, 100.0],
+                             [-9.0, 5.0, 101.9],
+                             [9.9, 0.0, 119.9],
+                             [10.0, 0.0, 110.0],   # Out of the area.
+                             [0.0, 0.0, 99.0]], numpy.float32)
+        grid.add_points(cloud)
+        self.assertEqual(grid.cells.sum(), 3)
+        self.assertEqual(grid.cells[0, 0], 2)
+        self.assertEqual(grid.cells[9, 9], 1)
+        grid.add_points(numpy.zeros((300, 3)) + (0.0, 0.0, 110.0))
+        self.assertEqual(grid.cells[5, 5], 255)
+        grid.clear()
+        self.assertFalse(grid.cells.any())
+
+    def test_occupied(self):
+        grid = kinect.OccupancyGrid(area=(-10.0, 100.0, 10.0, 120.0),
+                                    threshold=2)
+        grid.add_points(numpy.array([[0.5, 0.0, 105.0]] * 2))
+        self.assertTrue(grid.occupied(1.0, 104.5))
+        self.assertFalse(grid.occupied(3.0, 104.5))
+        self.assertFalse(grid.occupied(50.0, 104.5))
+        self.assertEqual(grid.occupied([1.0, 1.0, -20.0],
+                                       [105.0, 90.0, 105.0]).tolist(),
+                         [True, False, False])
+
+    def test_obstacles(self):
+        # Obstacles are made of points of the analysis band.
+        grid = kinect.OccupancyGrid()
+        for depth in load_depths():
+            cells = grid.update(depth)
+            self.assertTrue(cells is grid.cells)
+            for obstacle in kinect.extract_obstacles(depth, provide_raw=True):
+                x, y, z = obstacle.raw_data.T
+                x = kinect.x_to_cm(x, z)
+                inside = (-150.0 <= x) & (x < 150.0) \
+                        & (100.0 <= z) & (z < 300.0)
+                self.assertTrue(grid.occupied(x, z)[inside].all())
+
+
+class SegmentationBackendTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = load_depths()
+
+    def test_default(self):
+        self.assertTrue(kinect.DEFAULT_SEGMENTATION_BACKEND
+                        in kinect.SEGMENTATION_BACKENDS)
+        self.assertEqual(kinect.DepthProcessor().backend,
+                         kinect.DEFAULT_SEGMENTATION_BACKEND)
+        self.assertRaises(ValueError, kinect.DepthProcessor, backend='none')
+
+    def test_parity(self):
+        for dtype in (numpy.float32, numpy.float64):
+            expected = [kinect.DepthProcessor(dtype=dtype, backend='numpy')
+                        .extract_obstacles(depth, provide_raw=True)
+                        for depth in self.depths]
+            for backend in kinect.SEGMENTATION_BACKENDS:
+                processor = kinect.DepthProcessor(dtype=dtype, backend=backend)
+                for depth, reference in zip(self.depths, expected):
+                    found = processor.extract_obstacles(depth,
+                                                        provide_raw=True)
+                    self.assertEqual([o[:5] for o in found],
+                                     [o[:5] for o in reference])
+                    for o, r in zip(found, reference):
+                        self.assertTrue((o.raw_data == r.raw_data).all())
+
+    def test_kernels(self):
+        # Gaps in x, z jumps, single point feet and dropped high points.
+        x = numpy.array([0, 1, 2, 4, 5, 6, 7, 9], numpy.intp)
+        z = numpy.array([100, 105, 120, 130, 131, 132, 133, 90], numpy.float32)
+        height = numpy.array([1, 2, 0, 3, 9, 8.5, 3.5, 4], numpy.float32)
+        for name, backend in kinect.SEGMENTATION_BACKENDS.items():
+            kernel = backend(len(x), numpy.float32)
+            foot = numpy.empty(len(x), numpy.intp)
+            kept = numpy.empty(len(x), bool)
+            self.assertEqual(kernel(x, z, height, foot, kept, 10, 5), 4, name)
+            self.assertEqual(foot.tolist(), [0, 0, 1, 2, 2, 2, 2, 3], name)
+            self.assertEqual(kept.tolist(), [True, True, True, True, False,
+                                             False, True, True], name)
+            self.assertEqual(kernel(x[:1], z[:1], height[:1], foot[:1],
+                                    kept[:1], 10, 5), 1, name)
+
+
+class CoarseToFineTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = load_depths()
+        self.full = kinect.DepthProcessor()
+
+    def sparse(self):
+        "band of far floor with two feet of the first frame"
+        band = kinect.crop_band(self.depths[0]).copy()
+        sparse = numpy.empty_like(band)
+        sparse.fill(1000)
+        sparse[40:, 100:130] = band[40:, 100:130]
+        sparse[50:, 300:320] = band[50:, 300:320]
+        return sparse
+
+    def test_every_pixel(self):
+        # Without downsampling, results are the full search's.
+        processor = kinect.DepthProcessor(coarse=1, coarse_margin=0)
+        for depth in self.depths:
+            self.assertEqual(processor.extract_obstacles(depth),
+                             self.full.extract_obstacles(depth))
+
+    def test_sparse(self):
+        sparse = self.sparse()
+        for coarse in (2, 4, 8):
+            processor = kinect.DepthProcessor(coarse=coarse)
+            self.assertEqual(processor.extract_obstacles(sparse),
+                             self.full.extract_obstacles(sparse))
+            self.assertTrue(numpy.count_nonzero(processor._has_foreground)
+                            < 100)
+
+    def test_accuracy(self):
+        recall = []
+        for margin in (0, 1, 2):
+            processor = kinect.DepthProcessor(coarse=4, coarse_margin=margin)
+            found = borders = 0
+            for depth in self.depths:
+                processor.extract_obstacles(depth)
+                self.full.extract_obstacles(depth)
+                valid = self.full._ymax > 0
+                borders += numpy.count_nonzero(valid)
+                found += numpy.count_nonzero(
+                    valid & (processor._ymax == self.full._ymax))
+                # Nothing out of range is ever found.
+                self.assertFalse((processor._ymax > 0)[~valid].any())
+            recall.append(float(found) / borders)
+        self.assertEqual(recall, sorted(recall))
+        self.assertTrue(recall[1] > 0.99)
+
+    def test_background(self):
+        model = kinect.BackgroundModel(frames=1)
+        model.learn(self.depths[0])
+        processor = kinect.DepthProcessor(background=model, coarse=1,
+                                          coarse_margin=0)
+        reference = kinect.DepthProcessor(background=model)
+        for depth in self.depths[1:]:
+            self.assertEqual(processor.extract_obstacles(depth),
+                             reference.extract_obstacles(depth))
+
+    def test_incremental(self):
+        processor = kinect.IncrementalDepthProcessor(coarse=4)
+        sparse = self.sparse()
+        self.assertEqual(processor.extract_obstacles(sparse),
+                         self.full.extract_obstacles(sparse))
+        sparse[60:, 200:210] = kinect.crop_band(self.depths[0])[60:, 200:210]
+        self.assertEqual(processor.extract_obstacles(sparse),
+                         self.full.extract_obstacles(sparse))
+
+
+def reference_extract_obstacles(depth, band=(37, 196, 566, 85)):
+    """
+        column by column implementation extract_obstacles must agree with
+    """
+    dist = kinect.z_to_cm(depth)
+    bx, by, bw, bh = band
+    zone = dist[by:by + bh, bx:bx + bw]
+
+    borders = []
+    for x in xrange(zone.shape[1]):
+        non_null_y = numpy.argwhere(zone[:, x] <= 300.0)
+        if non_null_y.size:
+            ymax = numpy.max(non_null_y)
+            borders.append((bx + x, by + ymax, zone[ymax, x]))
+
+    feet = []
+    prev_x, _, prev_z = borders[0]
+    foot = []
+    for x, y, z in borders:
+        if x - prev_x <= 1 and abs(prev_z - z) < 10:
+            foot.append((x, y, z))
+        else:
+            feet.append(foot)
+            foot = [(x, y, z)]
+        prev_x, prev_z = x, z
+    feet.append(foot)
+
+    result = []
+    for foot in feet:
+        m = min(kinect.y_to_cm(y, z) for x, y, z in foot)
+        foot = [(x, y, z) for x, y, z in foot
+                if kinect.y_to_cm(y, z) - m <= 5]
+        left = min(kinect.x_to_cm(x, z) for x, y, z in foot)
+        right = max(kinect.x_to_cm(x, z) for x, y, z in foot)
+        close = min(z for x, y, z in foot)
+        far = max(z for x, y, z in foot)
+        result.append((left, close, right - left, far - close,
+                       min(y for x, y, z in foot), foot))
+    return result
+
+
+def are_nearly_equal(value1, value2, precision=0.01):
+    """
+        returns true when the first value is nearly equals to the second
+    """
+    return abs(value1 - value2) <= precision
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,319 @@
+"""
+kinect_bench.py
+
+Benchmark of the Kinect processing pipeline.
+
+Replays the recorded data/ sessions through each processing stage and reports
+latency percentiles, frames per second and peak memory per stage. Results
+are printed and can be written as JSON to compare revisions:
+
+    python kinect_bench.py [-n REPEAT] [-o results.json] [stage ...]
+
+Only numpy is needed: freenect, GTK and cocos are not used.
+
+"""
+
+import json
+import optparse
+import platform
+import subprocess
+import sys
+import timeit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy
+
+import kinect
+import kinect_image
+
+__all__ = ['STAGES',
+           'DATA_FILES',
+           'COARSE',
+           'coarse_accuracy',
+           'run']
+
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+# Downsampling factor of the coarse to fine stage.
+COARSE = 4
+
+# (name, factory) in pipeline order. A factory takes a KinectData and
+# returns the function to time on it.
+STAGES = []
+
+
+def stage(name):
+    "registers a stage factory"
+    def register(factory):
+        STAGES.append((name, factory))
+        return factory
+    return register
+
+
+@stage('z_to_cm')
+def _z_to_cm(data):
+    return lambda: kinect.z_to_cm(data.depth)
+
+
+@stage('band_to_cm')
+def _band_to_cm(data):
+    band = kinect.crop_band(data.depth)
+    out = numpy.empty(band.shape)
+    return lambda: kinect.z_to_cm(band, out=out)
+
+
+@stage('extract_obstacles')
+def _extract_obstacles(data):
+    return lambda: kinect.extract_obstacles(data.depth)
+
+
+@stage('extract_obstacles_raw')
+def _extract_obstacles_raw(data):
+    return lambda: kinect.extract_obstacles(data.depth, provide_raw=True)
+
+
+@stage('depth_processor')
+def _depth_processor(data):
+    processor = kinect.DepthProcessor()
+    return lambda: processor.extract_obstacles(data.depth)
+
+
+@stage('depth_processor_coarse')
+def _depth_processor_coarse(data):
+    processor = kinect.DepthProcessor(coarse=COARSE, coarse_margin=1)
+    return lambda: processor.extract_obstacles(data.depth)
+
+
+def _borders(depth):
+    "border points (x, z, height) of the analysis band, as segmented"
+    processor = kinect.DepthProcessor(backend='numpy')
+    processor.extract_obstacles(depth)
+    columns = numpy.flatnonzero(processor._ymax > 0)
+    x = columns + processor.band[0]
+    y = processor._ymax[columns] + processor.band[1] - 1
+    z = processor._column_z[columns]
+    return x, z, kinect.y_to_cm(y, z).astype(z.dtype)
+
+
+def _segmentation(backend):
+    def factory(data):
+        x, z, height = _borders(data.depth)
+        kernel = backend(len(x), z.dtype)
+        foot = numpy.empty(len(x), numpy.intp)
+        kept = numpy.empty(len(x), bool)
+        return lambda: kernel(x, z, height, foot, kept,
+                              kinect.DepthProcessor.MAX_Z_CHANGE,
+                              kinect.DepthProcessor.MAX_BORDER_HEIGHT)
+    return factory
+
+for _name, _backend in sorted(kinect.SEGMENTATION_BACKENDS.items()):
+    stage('segmentation_' + _name)(_segmentation(_backend))
+
+
+@stage('point_cloud')
+def _point_cloud(data):
+    return lambda: kinect.to_point_cloud(data.depth)
+
+
+@stage('occupancy_grid')
+def _occupancy_grid(data):
+    grid = kinect.OccupancyGrid()
+    return lambda: grid.update(data.depth)
+
+
+def _surface_image():
+    "image over a buffer standing for the data of a display surface"
+    return kinect_image.argb32_view(bytearray(640 * 480 * 4), 640, 480)
+
+
+@stage('gui_rgb')
+def _gui_rgb(data):
+    image = _surface_image()
+    return lambda: kinect_image.rgb_to_argb32(data.rgb, out=image)
+
+
+@stage('gui_depth')
+def _gui_depth(data):
+    image = _surface_image()
+    return lambda: kinect_image.depth_to_argb32(data.depth, out=image)
+
+
+@stage('gui_depth_colormap')
+def _gui_depth_colormap(data):
+    image = _surface_image()
+    colormap = kinect_image.DepthColormap(threshold=16, stride=4)
+    return lambda: colormap(data.depth, out=image)
+
+
+def coarse_accuracy(coarse=COARSE, margin=1, files=DATA_FILES):
+    '''Accuracy of the coarse to fine search against the full search, on
+    recorded frames. Returns a dictionary:
+        border_recall:      fraction of the column borders found the same
+        identical_frames:   frames with the same obstacles
+        frames:             number of frames
+    '''
+    full = kinect.DepthProcessor()
+    fast = kinect.DepthProcessor(coarse=coarse, coarse_margin=margin)
+    borders = found = identical = 0
+    for f in files:
+        depth = numpy.load(f + '_depth.npy')
+        expected = [o[:5] for o in full.extract_obstacles(depth)]
+        identical += expected == [o[:5] for o in fast.extract_obstacles(depth)]
+        valid = full._ymax > 0
+        borders += numpy.count_nonzero(valid)
+        found += numpy.count_nonzero(valid & (fast._ymax == full._ymax))
+    return {
+        'coarse': coarse,
+        'margin': margin,
+        'border_recall': float(found) / borders if borders else 1.0,
+        'identical_frames': identical,
+        'frames': len(files),
+        }
+
+
+def _peak_memory(function):
+    "peak memory allocated by a call, in bytes, None if unknown"
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(stages=None, repeat=50, files=DATA_FILES):
+    '''Runs the benchmark, returns results as a dictionary.
+        stages:     names of the stages to run, all by default
+        repeat:     calls per stage and per recorded frame
+        files:      recorded frames, without extension
+    '''
+    data = [kinect.KinectData(real_kinect=False,
+                              rgb=numpy.load(f + '_rgb.npy'),
+                              depth=numpy.load(f + '_depth.npy'))
+            for f in files]
+    timer = timeit.default_timer
+
+    results = {}
+    for name, factory in STAGES:
+        if stages and name not in stages:
+            continue
+        latencies = []
+        peak = None
+        for frame in data:
+            function = factory(frame)
+            function()  # Warm up caches and buffers.
+            memory = _peak_memory(function)
+            if memory is not None:
+                peak = max(peak, memory)
+            for i in xrange(repeat):
+                start = timer()
+                function()
+                latencies.append(timer() - start)
+        latencies = numpy.array(latencies) * 1000.0
+        p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+        results[name] = {
+            'calls': len(latencies),
+            'mean_ms': latencies.mean(),
+            'p50_ms': p50,
+            'p90_ms': p90,
+            'p99_ms': p99,
+            'max_ms': latencies.max(),
+            'fps': 1000.0 / latencies.mean(),
+            'peak_bytes': peak,
+            }
+
+    # Compiled segmentation kernels against the numpy reference.
+    speedups = {}
+    reference = results.get('segmentation_numpy')
+    for name in kinect.SEGMENTATION_BACKENDS:
+        backend = results.get('segmentation_' + name)
+        if reference and backend and name != 'numpy':
+            speedups[name] = reference['mean_ms'] / backend['mean_ms']
+
+    accuracy = None
+    if 'depth_processor_coarse' in results:
+        accuracy = coarse_accuracy(files=files)
+
+    return {
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'files': list(files),
+        # Process wide, tracemalloc is not available before Python 3.4.
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                      if resource else None,
+        'stages': results,
+        'segmentation_speedups': speedups,
+        'coarse_accuracy': accuracy,
+        }
+
+
+def report(results, out=sys.stdout):
+    "prints results as a table"
+    out.write('%-22s %8s %8s %8s %8s %9s %10s\n' % (
+        'stage', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'fps', 'peak KB'))
+    for name, factory in STAGES:
+        if name not in results['stages']:
+            continue
+        r = results['stages'][name]
+        peak = '-' if r['peak_bytes'] is None else '%d' % (
+                r['peak_bytes'] // 1024)
+        out.write('%-22s %8.3f %8.3f %8.3f %8.3f %9.1f %10s\n' % (
+            name, r['mean_ms'], r['p50_ms'], r['p90_ms'], r['p99_ms'],
+            r['fps'], peak))
+    for name, speedup in sorted(results['segmentation_speedups'].items()):
+        out.write('segmentation speedup of %s over numpy: %.1fx\n' % (
+            name, speedup))
+    accuracy = results['coarse_accuracy']
+    if accuracy:
+        out.write('coarse x%(coarse)d margin %(margin)d: border recall '
+                  '%(border_recall).4f, identical frames '
+                  '%(identical_frames)d/%(frames)d\n' % accuracy)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+            usage='%prog [-n REPEAT] [-o FILE] [stage ...]')
+    parser.add_option('-n', '--repeat', type='int', default=50,
+                      help='calls per stage and recorded frame [%default]')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='write results as JSON to FILE')
+    options, stages = parser.parse_args(argv)
+    unknown = set(stages) - set(name for name, factory in STAGES)
+    if unknown:
+        parser.error('unknown stages: %s' % ', '.join(sorted(unknown)))
+
+    results = run(stages, options.repeat)
+    report(results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import json
+import unittest
+import kinect
+import kinect_bench
+
+
+class BenchTest (unittest.TestCase):
+
+    def test_run(self):
+        results = kinect_bench.run(['extract_obstacles', 'gui_rgb'], repeat=2)
+        self.assertEqual(sorted(results['stages']),
+                         ['extract_obstacles', 'gui_rgb'])
+        stage = results['stages']['extract_obstacles']
+        self.assertEqual(stage['calls'], 2 * len(kinect_bench.DATA_FILES))
+        self.assertTrue(0 < stage['p50_ms'] <= stage['p99_ms'])
+        self.assertTrue(stage['fps'] > 0)
+        json.loads(json.dumps(results))
+
+    def test_segmentation_speedups(self):
+        stages = ['segmentation_' + name
+                  for name in kinect.SEGMENTATION_BACKENDS]
+        results = kinect_bench.run(stages, repeat=2)
+        self.assertEqual(sorted(results['segmentation_speedups']),
+                         sorted(set(kinect.SEGMENTATION_BACKENDS) -
+                                set(['numpy'])))
+        for speedup in results['segmentation_speedups'].values():
+            self.assertTrue(speedup > 0)
+
+    def test_coarse_accuracy(self):
+        results = kinect_bench.run(['depth_processor_coarse'], repeat=2)
+        accuracy = results['coarse_accuracy']
+        self.assertEqual(accuracy['frames'], len(kinect_bench.DATA_FILES))
+        self.assertTrue(0.9 < accuracy['border_recall'] <= 1.0)
+        exact = kinect_bench.coarse_accuracy(coarse=1, margin=0)
+        self.assertEqual(exact['border_recall'], 1.0)
+        self.assertEqual(exact['identical_frames'], exact['frames'])
+
+    def test_stage_names(self):
+        names = [name for name, factory in kinect_bench.STAGES]
+        self.assertEqual(len(names), len(set(names)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+kinect_fusion.py
+
+Fusion of the obstacles of several Kinects into one gaming area.
+
+Each sensor is placed in the arena by its extrinsic calibration, a
+SensorPose: position of the sensor in the arena top view and yaw. Obstacles
+and point clouds of a sensor are moved to the arena frame, then obstacles of
+all the sensors seen overlapping are merged.
+
+Top view coordinates are those of kinect.Obstacle: x is lateral, y is depth.
+With a null yaw, a sensor looks along the arena y axis.
+
+"""
+
+from collections import namedtuple
+import json
+import math
+
+import numpy
+
+import kinect
+
+__all__ = ['SensorPose',
+           'ArenaFusion',
+           'load_calibration',
+           'save_calibration']
+
+# Extrinsic calibration of a sensor.
+#
+# x, y      Position of the sensor in the arena top view, in cm
+# yaw       Rotation of the sensor in the top view, in degrees,
+#           counterclockwise
+SensorPose = namedtuple('SensorPose', 'x y yaw')
+
+
+def load_calibration(filename):
+    "Reads a list of SensorPose from a JSON file"
+    with open(filename) as f:
+        return [SensorPose(**pose) for pose in json.load(f)]
+
+
+def save_calibration(filename, poses):
+    "Writes a list of SensorPose to a JSON file"
+    with open(filename, 'w') as f:
+        json.dump([pose._asdict() for pose in poses], f, indent=2)
+
+
+class ArenaFusion(object):
+    '''Merges obstacles of calibrated sensors in the arena frame.
+
+    fusion = ArenaFusion(poses, cell=20.0, tolerance=2.0)
+        poses:      SensorPose of each sensor
+        cell:       size in cm of the cells of the spatial index
+        tolerance:  obstacles closer than this, in cm, are merged
+    '''
+
+    def __init__(self, poses, cell=20.0, tolerance=2.0):
+        self.poses = list(poses)
+        self.cell = cell
+        self.tolerance = tolerance
+        self._rotations = []
+        for pose in self.poses:
+            a = math.radians(pose.yaw)
+            self._rotations.append(numpy.array([[math.cos(a), -math.sin(a)],
+                                                [math.sin(a), math.cos(a)]]))
+
+    def _to_arena(self, sensor, points):
+        "(n, 2) top view points of a sensor to the arena frame"
+        pose = self.poses[sensor]
+        return points.dot(self._rotations[sensor].T) + (pose.x, pose.y)
+
+    def to_arena(self, sensor, obstacles):
+        '''Obstacles of a sensor (Obstacle list or (n, 5) array, see
+        kinect_pool) as an (n, 5) array in the arena frame. Boxes are the
+        bounding boxes of the rotated obstacle boxes.'''
+        boxes = numpy.array([o[:5] for o in obstacles], float).reshape(-1, 5)
+        x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        corners = numpy.stack((
+            numpy.stack((x, y), axis=1),
+            numpy.stack((x + w, y), axis=1),
+            numpy.stack((x, y + h), axis=1),
+            numpy.stack((x + w, y + h), axis=1)), axis=1)
+        corners = self._to_arena(sensor, corners.reshape(-1, 2)) \
+                .reshape(-1, 4, 2)
+        low = corners.min(axis=1)
+        high = corners.max(axis=1)
+        return numpy.column_stack((low, high - low, boxes[:, 4]))
+
+    def points_to_arena(self, sensor, cloud):
+        '''(N, 3) point cloud of a sensor (see kinect.to_point_cloud) in the
+        arena frame: x lateral, y height, z depth.'''
+        moved = numpy.empty(cloud.shape, cloud.dtype)
+        moved[:, [0, 2]] = self._to_arena(sensor, cloud[:, [0, 2]])
+        moved[:, 1] = cloud[:, 1]
+        return moved
+
+    def fuse(self, obstacles):
+        '''Obstacles of every sensor, in sensor order, to the list of
+        obstacles in the arena. Overlapping boxes are merged into their
+        bounding box, with the lowest z.'''
+        boxes = numpy.concatenate(
+            [self.to_arena(sensor, sensor_obstacles)
+             for sensor, sensor_obstacles in enumerate(obstacles)]
+            + [numpy.zeros((0, 5))])
+        groups = self._overlapping(boxes)
+
+        low = boxes[:, :2]
+        high = boxes[:, :2] + boxes[:, 2:4]
+        order = numpy.argsort(groups, kind='mergesort')
+        starts = numpy.flatnonzero(numpy.diff(
+            numpy.concatenate(([-1], groups[order]))))
+        if not len(order):
+            return []
+        merged_low = numpy.minimum.reduceat(low[order], starts)
+        merged_high = numpy.maximum.reduceat(high[order], starts)
+        merged_z = numpy.minimum.reduceat(boxes[order, 4], starts)
+        return [kinect.Obstacle(x=l[0], y=l[1], width=h[0] - l[0],
+                                height=h[1] - l[1], z=z, raw_data=None)
+                for l, h, z in zip(merged_low, merged_high, merged_z)]
+
+    def _overlapping(self, boxes):
+        '''Group number of each box, boxes overlapping (within tolerance)
+        being in the same group.'''
+        parents = numpy.arange(len(boxes))
+
+        def root(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        # Spatial index: boxes by grid cells they cover.
+        margin = self.tolerance / 2.0
+        low = numpy.floor((boxes[:, :2] - margin) / self.cell).astype(int)
+        high = numpy.floor((boxes[:, :2] + boxes[:, 2:4] + margin)
+                           / self.cell).astype(int)
+        cells = {}
+        for i in xrange(len(boxes)):
+            for cx in xrange(low[i, 0], high[i, 0] + 1):
+                for cy in xrange(low[i, 1], high[i, 1] + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+
+        # Only boxes sharing a cell may overlap.
+        for members in cells.itervalues():
+            for n, i in enumerate(members):
+                for j in members[n + 1:]:
+                    if self._overlap(boxes[i], boxes[j]):
+                        parents[root(i)] = root(j)
+        return numpy.array([root(i) for i in xrange(len(boxes))], int)
+
+    def _overlap(self, a, b):
+        t = self.tolerance
+        return a[0] <= b[0] + b[2] + t and b[0] <= a[0] + a[2] + t \
+                and a[1] <= b[1] + b[3] + t and b[1] <= a[1] + a[3] + t
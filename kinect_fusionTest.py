@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+import numpy
+import kinect
+import kinect_fusion
+
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+
+def box(x, y, width, height, z=20.0):
+    return kinect.Obstacle(x, y, width, height, z, None)
+
+
+class ArenaFusionTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = [numpy.load(f + '_depth.npy') for f in DATA_FILES]
+
+    def test_identity(self):
+        fusion = kinect_fusion.ArenaFusion([kinect_fusion.SensorPose(0, 0, 0)])
+        for depth in self.depths:
+            obstacles = kinect.extract_obstacles(depth)
+            moved = fusion.to_arena(0, obstacles)
+            self.assertEqual(moved.shape, (len(obstacles), 5))
+            for row, obstacle in zip(moved, obstacles):
+                self.assertTrue(numpy.allclose(row, obstacle[:5]))
+
+    def test_pose(self):
+        # Sensor at (100, 50) looking along arena -x.
+        fusion = kinect_fusion.ArenaFusion(
+                [kinect_fusion.SensorPose(100.0, 50.0, 90.0)])
+        moved = fusion.to_arena(0, [box(10.0, 200.0, 20.0, 5.0, 12.0)])
+        self.assertTrue(numpy.allclose(
+            moved, [[100.0 - 205.0, 50.0 + 10.0, 5.0, 20.0, 12.0]]))
+
+    def test_point_cloud(self):
+        fusion = kinect_fusion.ArenaFusion(
+                [kinect_fusion.SensorPose(100.0, 50.0, 90.0)])
+        cloud = kinect.to_point_cloud(self.depths[0], stride=8)
+        moved = fusion.points_to_arena(0, cloud)
+        self.assertEqual(moved.dtype, cloud.dtype)
+        self.assertTrue(numpy.allclose(moved[:, 0], 100.0 - cloud[:, 2],
+                                       atol=1e-3))
+        self.assertTrue((moved[:, 1] == cloud[:, 1]).all())
+        self.assertTrue(numpy.allclose(moved[:, 2], 50.0 + cloud[:, 0],
+                                       atol=1e-3))
+
+    def test_merge(self):
+        fusion = kinect_fusion.ArenaFusion(
+                [kinect_fusion.SensorPose(0, 0, 0),
+                 kinect_fusion.SensorPose(0, 400.0, 180.0)], cell=10.0)
+        # Same foot seen from both sides, plus one foot seen by one sensor.
+        first = [box(-10.0, 195.0, 10.0, 10.0, 8.0), box(50.0, 100.0, 8.0, 8.0)]
+        second = [box(2.0, 192.0, 10.0, 10.0, 9.0)]
+        fused = fusion.fuse([first, second])
+        self.assertEqual(len(fused), 2)
+        fused.sort(key=lambda o: o.x)
+        merged, single = fused
+        self.assertTrue(numpy.allclose(
+            merged[:5], (-12.0, 195.0, 12.0, 13.0, 8.0)))
+        self.assertTrue(numpy.allclose(single[:5], first[1][:5]))
+
+    def test_chain(self):
+        # Overlaps are transitive, even across index cells.
+        fusion = kinect_fusion.ArenaFusion(
+                [kinect_fusion.SensorPose(0, 0, 0)], cell=5.0, tolerance=0.0)
+        fused = fusion.fuse([[box(0.0, 0.0, 10.0, 2.0),
+                              box(9.0, 0.0, 10.0, 2.0),
+                              box(18.0, 0.0, 10.0, 2.0),
+                              box(40.0, 0.0, 10.0, 2.0)]])
+        self.assertEqual(sorted((o.x, o.width) for o in fused),
+                         [(0.0, 28.0), (40.0, 10.0)])
+
+    def test_empty(self):
+        fusion = kinect_fusion.ArenaFusion(
+                [kinect_fusion.SensorPose(0, 0, 0)] * 2)
+        self.assertEqual(fusion.fuse([[], []]), [])
+
+    def test_calibration(self):
+        poses = [kinect_fusion.SensorPose(0.0, 0.0, 0.0),
+                 kinect_fusion.SensorPose(120.0, 450.0, 180.0)]
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            kinect_fusion.save_calibration(filename, poses)
+            self.assertEqual(kinect_fusion.load_calibration(filename), poses)
+        finally:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
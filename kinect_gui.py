@@ -1,4 +1,5 @@
 import kinect
+import kinect_image
 import numpy
 
 import pygtk
@@ -9,28 +10,164 @@ import gobject
 
 import cairo
 
+import threading
 import time
 
+from collections import namedtuple
+
 GAMING_AREA = (-150.0, 100.0, 150.0, 300.0)  # Centimeters (x0, z0, x1, z1)
 GAMING_DETECTION_ZONE = (37, 196, 566, 85)  # Pixels
 
+# Kinect data with its obstacles and capture time, see FrameProducer.
+AnalyzedFrame = namedtuple('AnalyzedFrame',
+                           'found_kinect rgb depth obstacles timestamp')
+
+
+def analyze_frame(processor=None):
+    "Gets buffers from the Kinect and extracts obstacles of the detection zone"
+    found_kinect, rgb, depth = kinect.get_buffers()
+    timestamp = time.time()
+    if processor is None:
+        obstacles = kinect.extract_obstacles(depth,
+                                             band=GAMING_DETECTION_ZONE,
+                                             provide_raw=True)
+    else:
+        obstacles = processor.extract_obstacles(depth, provide_raw=True)
+    return AnalyzedFrame(found_kinect, rgb, depth, obstacles, timestamp)
+
+
+def feet_outlines(obstacles, pixels, max_vertices=None, tolerance=1.0):
+    '''Outlines of the obstacles of a frame as lists of int (x, y) vertices.
+        pixels:     function of the (n, 3) raw data of all the obstacles,
+                    returning the (n, 2) int array of their pixels
+        max_vertices, tolerance: optional decimation of each outline, see
+                    kinect_image.decimate
+    '''
+    if not obstacles:
+        return []
+    raw_data = numpy.concatenate([o.raw_data for o in obstacles])
+    ends = numpy.cumsum([len(o.raw_data) for o in obstacles])
+    outlines = numpy.split(pixels(raw_data), ends[:-1])
+    if max_vertices is not None:
+        outlines = [kinect_image.decimate(outline, max_vertices, tolerance)[0]
+                    for outline in outlines]
+    return [outline.tolist() for outline in outlines]
+
+
+class FrameProducer(object):
+    '''Captures and analyzes frames in a worker thread, out of the GTK main
+    loop.
+
+    producer = FrameProducer(consumer, period=1 / 30.0)
+        consumer:   called in the main loop with each AnalyzedFrame
+        period:     minimal time between two frames, in seconds
+
+    Frames are handed over with gobject.idle_add. When the main loop is
+    busy, only the newest frame is delivered: stale ones are dropped.
+    gobject.threads_init() must have been called.
+    '''
+
+    def __init__(self, consumer, period=1 / 30.0):
+        self._consumer = consumer
+        self.period = period
+        self.produced = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='kinect-gui-producer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        "Stops the worker, frames not delivered yet are dropped."
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._pending = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        # Own processor: the one of kinect.extract_obstacles is not to be
+        # shared between threads.
+        processor = kinect.DepthProcessor(GAMING_DETECTION_ZONE,
+                                          dtype=numpy.float64)
+        deadline = time.time()
+        while not self._stopped.is_set():
+            frame = analyze_frame(processor)
+            with self._lock:
+                self.produced += 1
+                if self._pending is not None:
+                    self.dropped += 1
+                else:
+                    gobject.idle_add(self._deliver)
+                self._pending = frame
+            deadline = max(deadline + self.period, time.time())
+            self._stopped.wait(deadline - time.time())
+
+    def _deliver(self):
+        with self._lock:
+            frame, self._pending = self._pending, None
+        if frame is not None and not self._stopped.is_set():
+            self._consumer(frame)
+        return False  # Once.
+
 
 class KinectDisplay(gtk.DrawingArea):
+    '''Camera images, detection band and feet, with a cursor following the
+    mouse.
 
-    def __init__(self):
+    Layers that only change with data (camera images, static annotations,
+    obstacles) are drawn once per refresh into a cached scene surface.
+    Exposes paint the scene within the exposed area only, then the cursor:
+    moving the mouse only invalidates the areas of the old and new cursor.
+    '''
+
+    CURSOR_TEXT_AREA = (940, 455, 340, 25)  # Pixels (x, y, w, h)
+
+    def __init__(self, max_vertices=None, tolerance=1.0):
 
         gtk.DrawingArea.__init__(self)
         self.set_size_request(1280, 480)
 
         self._found = False
-        self._rgb_surface = None
-        self._depth_surface = None
+
+        # Persistent surfaces, converted images are written in place.
+        self._rgb_surface, self._rgb_image = self._create_surface()
+        self._depth_surface, self._depth_image = self._create_surface()
+        self._colormap = kinect_image.DepthColormap(threshold=16, stride=4)
+
+        # Cached layers.
+        self._scene = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1280, 480)
+        self._scene_dirty = True
+        self._annotations = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1280, 480)
+        self._draw_annotations(cairo.Context(self._annotations))
 
         self._observers = []
 
+        # Feet entering, moving and leaving: subscribe to it rather than
+        # observing whole obstacle lists. Observers only get the cursor.
+        # Feet leave as soon as they are missed, and every detection is
+        # published: the feet of the events are those of the frame shown.
+        self.events = kinect.ObstacleEvents(
+                kinect.ObstacleTracker(max_missed=0), min_move=0.0)
+
         self._x = -1
         self._y = -1
         self._obstacles = []
+        self._outlines = []
+        self._max_vertices = max_vertices
+        self._tolerance = tolerance
         self.refresh_data()
 
         self.add_events(gtk.gdk.MOTION_NOTIFY
@@ -42,76 +179,115 @@ class KinectDisplay(gtk.DrawingArea):
 
         self.connect("expose_event", self.expose)
 
+    def _create_surface(self, width=640, height=480):
+        "ARGB32 surface and an image view of its data"
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        image = kinect_image.argb32_view(surface.get_data(), width, height)
+        return surface, image
+
+    def set_palette(self, palette):
+        "Colors the depth map with a palette of kinect_image.PALETTES"
+        self._colormap = kinect_image.DepthColormap(palette, threshold=16,
+                                                    stride=4)
+        # The current frame is recolored: no capture in the main loop.
+        self._show_depth()
+        self._scene_dirty = True
+        self.queue_draw()
+
+    def _depth_pixels(self, raw_data):
+        "Pixels of raw data in the depth map"
+        pixels = raw_data[:, :2].astype(int)
+        pixels[:, 0] += 640
+        return pixels
+
     def add_observer(self, observer):
         self._observers.append(observer)
 
     def _notify_observers(self):
         data = {}
         data['cursor'] = self._x, self._y, self._depth[self._y, self._x]
-        data['obstacles'] = self._obstacles
 
         for observer in self._observers:
             observer.observable_changed(data)
 
-    def leave_notify(self, widget, event):
-        self._x, self._y = -1, -1
+    def _cursor_areas(self):
+        "Rectangles (x, y, w, h) covered by the cursor"
+        if self._x < 0 or self._y < 0:
+            return []
+        return [(0, self._y - 1, 1280, 3),
+                (self._x - 1, 0, 3, 480),
+                (self._x + 640 - 1, 0, 3, 480),
+                self.CURSOR_TEXT_AREA]
+
+    def _move_cursor(self, x, y):
+        old_areas = self._cursor_areas()
+        self._x, self._y = x, y
         self._notify_observers()
-        self.queue_draw()
+        for area in old_areas + self._cursor_areas():
+            self.queue_draw_area(*area)
+
+    def leave_notify(self, widget, event):
+        self._move_cursor(-1, -1)
 
     def motion_notify(self, widget, event):
-        x, y = event.x, event.y
+        x, y = int(event.x), int(event.y)
 
         if x >= 640:
             x -= 640
 
-        self._x, self._y = x, y
-        self._notify_observers()
-        self.queue_draw()
+        self._move_cursor(x, y)
 
     def expose(self, widget, event):
         self.context = widget.window.cairo_create()
+        area = event.area
+        self.context.rectangle(area.x, area.y, area.width, area.height)
+        self.context.clip()
         self.draw(self.context)
         return False
 
     def refresh_data(self):
-        # Get raw data.
-        self._found_kinect, self._rgb, self._depth = kinect.get_buffers()
+        "Gets and shows a frame, in the main loop. See FrameProducer."
+        self.show_frame(analyze_frame())
 
-        # Perform basic data extraction.
-        self._obstacles = kinect.extract_obstacles(
-                self._depth,
-                band=GAMING_DETECTION_ZONE,
-                provide_raw=True)
+    def show_frame(self, frame):
+        "Shows an AnalyzedFrame"
+        self._found_kinect, self._rgb, self._depth, self._obstacles = \
+                frame[:4]
+        self.events.update(self._obstacles, frame.timestamp)
+        self._outlines = feet_outlines(
+                self._obstacles, self._depth_pixels,
+                self._max_vertices, self._tolerance)
 
-        # Convert numpy arrays to cairo surfaces.
-        alpha_channel = numpy.ones((480, 640, 1), dtype=numpy.uint8) * 255
+        # Convert numpy arrays into the cairo surfaces.
 
         # 1. RGB bitmap.
-        rgb32 = numpy.concatenate((alpha_channel, self._rgb), axis=2)
-        self._rgb_surface = cairo.ImageSurface.create_for_data(
-                rgb32[:, :, ::-1].astype(numpy.uint8),
-                cairo.FORMAT_ARGB32, 640, 480)
-
-        # 2. Depth map, take care of special NaN value.
-        i = numpy.amin(self._depth)
-        depth_clean = numpy.where(
-                self._depth == kinect.UNDEF_DEPTH,
-                0,
-                self._depth)
-        a = numpy.amax(depth_clean)
-        depth = numpy.where(
-                self._depth == kinect.UNDEF_DEPTH,
-                0,
-                255 - (self._depth - i) * 254.0 / (a - i))
-        depth32 = numpy.dstack((
-            alpha_channel, depth, numpy.where(depth == 0, 128, depth), depth))
-        self._depth_surface = cairo.ImageSurface.create_for_data(
-                depth32[:, :, ::-1].astype(numpy.uint8),
-                cairo.FORMAT_ARGB32, 640, 480)
+        self._rgb_surface.flush()
+        kinect_image.rgb_to_argb32(self._rgb, out=self._rgb_image)
+        self._rgb_surface.mark_dirty()
 
+        # 2. Depth map.
+        self._show_depth()
+
+        self._scene_dirty = True
         self._notify_observers()
 
+    def _show_depth(self):
+        "Colors the depth map into its surface"
+        self._depth_surface.flush()
+        self._colormap(self._depth, out=self._depth_image)
+        self._depth_surface.mark_dirty()
+
     def draw(self, ctx):
+        if self._scene_dirty:
+            self._draw_scene(cairo.Context(self._scene))
+            self._scene_dirty = False
+
+        ctx.set_source_surface(self._scene)
+        ctx.paint()
+        self._draw_cursor(ctx)
+
+    def _draw_scene(self, ctx):
+        "Layers that only change with data."
 
         # Draw surfaces.
         ctx.save()
@@ -125,6 +301,30 @@ class KinectDisplay(gtk.DrawingArea):
 
         ctx.restore()
 
+        ctx.set_source_surface(self._annotations)
+        ctx.paint()
+
+        # Draw detected feet in detection zone.
+        ctx.set_line_width(2)
+        ctx.set_source_rgb(1, 0, 0)
+        for outline in self._outlines:
+            ctx.move_to(*outline[0])
+            for x, y in outline[1:]:
+                ctx.line_to(x, y)
+            ctx.stroke()
+
+        # Tell if images are not from a present device.
+        if not self._found_kinect:
+            ctx.select_font_face('Sans')
+            ctx.set_font_size(20)
+            ctx.move_to(20, 20)
+            ctx.set_source_rgb(0.0, 0.0, 1.0)
+            ctx.show_text("No Kinect detected, using static picture from disk")
+            ctx.stroke()
+
+    def _draw_annotations(self, ctx):
+        "Static annotations, on a transparent layer."
+
         # Dectection band.
         ctx.set_line_width(2)
         ctx.set_source_rgb(0.0, 0.0, 1.0)
@@ -151,6 +351,7 @@ class KinectDisplay(gtk.DrawingArea):
         ctx.show_text('x')
         ctx.stroke()
 
+    def _draw_cursor(self, ctx):
         # Trace lines.
         if self._x >= 0 and self._y >= 0:
             ctx.set_source_rgb(1.0, 0.0, 0.0)
@@ -177,35 +378,27 @@ class KinectDisplay(gtk.DrawingArea):
             else:
                 text = "(%d, %d)" % (self._x, self._y)
 
+            ctx.select_font_face('Sans')
             ctx.set_font_size(16)
             ctx.move_to(950, 475)
             ctx.set_source_rgb(1, 1, 1)
             ctx.show_text(text)
             ctx.stroke()
 
-        # Draw detected feet in detection zone.
-        ctx.set_line_width(2)
-        ctx.set_source_rgb(1, 0, 0)
-        for obstacle in self._obstacles:
-            raw_data = obstacle[-1]
-            x, y, _ = raw_data[0]
-            ctx.move_to(640 + x, y)
-            for x, y, _ in raw_data[1:]:
-                ctx.line_to(640 + x, y)
-            ctx.stroke()
 
-        # Tell if images are not from a present device.
-        if not self._found_kinect:
-            ctx.set_font_size(20)
-            ctx.move_to(20, 20)
-            ctx.set_source_rgb(0.0, 0.0, 1.0)
-            ctx.show_text("No Kinect detected, using static picture from disk")
-            ctx.stroke()
+class GameSceneArea(gtk.DrawingArea):
+    '''Top view of the gaming area, with the detected feet.
 
+    scene = GameSceneArea(size, max_vertices=None, tolerance=1.0)
+        size:       (width, height) in pixels
+        max_vertices, tolerance: optional decimation of the outlines of the
+                    feet, see kinect_image.decimate (tolerance in pixels)
 
-class GameSceneArea(gtk.DrawingArea):
+    Feet come from the events of an ObstacleEvents, see follow. They are
+    converted to pixels when they change, as whole arrays.
+    '''
 
-    def __init__(self, size):
+    def __init__(self, size, max_vertices=None, tolerance=1.0):
         gtk.DrawingArea.__init__(self)
         self.set_size_request(*size)
         self.connect("expose_event", self.expose)
@@ -213,7 +406,12 @@ class GameSceneArea(gtk.DrawingArea):
         self._z = -1
         self._y = -1
         self._x = -1
-        self._obstacles = []
+        self._events = None
+        self._feet_dirty = False
+        self._boxes = []
+        self._outlines = []
+        self._max_vertices = max_vertices
+        self._tolerance = tolerance
 
         # Compute pixel per cm.
         l, h = size  # pixels
@@ -229,10 +427,43 @@ class GameSceneArea(gtk.DrawingArea):
 
     def observable_changed(self, data):
         self._x, self._y, self._z = data['cursor']
-        self._obstacles = data['obstacles']
         self.queue_draw()
 
+    def follow(self, events):
+        "Shows the feet of an ObstacleEvents. Returns its subscription token."
+        self._events = events
+        self._feet_dirty = True
+        return events.subscribe(self._foot_event)
+
+    def _foot_event(self, event):
+        self._feet_dirty = True
+        self.queue_draw()
+
+    def _update_feet(self):
+        "Boxes and outlines of the feet, in pixels"
+        obstacles = [] if self._events is None \
+                else self._events.feet.values()
+        boxes = numpy.array([o[:4] for o in obstacles], float).reshape(-1, 4)
+        x, y, w, h = boxes.T
+        top_left = self._to_pixels(-x - w, y)
+        bottom_right = self._to_pixels(-x, y + h)
+        self._boxes = numpy.hstack(
+            (top_left, bottom_right - top_left)).tolist()
+        self._outlines = feet_outlines(
+                obstacles, self._raw_data_pixels,
+                self._max_vertices, self._tolerance)
+
+    def _to_pixels(self, x, z):
+        return kinect_image.top_view_pixels(x, z, self._px_per_cm)
+
+    def _raw_data_pixels(self, raw_data):
+        z = raw_data[:, 2]
+        return self._to_pixels(-kinect.x_to_cm(raw_data[:, 0], z), z)
+
     def draw(self, ctx):
+        if self._feet_dirty:
+            self._update_feet()
+            self._feet_dirty = False
 
         # Coordinate system.
         ctx.set_line_width(1)
@@ -322,30 +553,17 @@ class GameSceneArea(gtk.DrawingArea):
             ctx.stroke()
 
         # Detected feet.
-        ctx.set_line_width(2)
-        ctx.set_source_rgb(0.5, 0, 0)
-        for obstacle in self._obstacles:
-            x, y, w, h, z, raw_data = obstacle
+        for box, outline in zip(self._boxes, self._outlines):
 
             # Obstacle box.
-            px = self.x_to_pixel(-x - w)
-            py = self.z_to_pixel(y)
-            pw = self.x_to_pixel(- x) - px
-            ph = self.z_to_pixel(y + h) - py
-
-            ctx.rectangle(px, py, pw, ph)
+            ctx.rectangle(*box)
             ctx.set_line_width(2)
             ctx.set_source_rgb(0.0, 0.5, 0.0)
             ctx.stroke()
 
             # Raw data from Kinect.
-            px, _, z = raw_data[0]
-            x = self.x_to_pixel(-kinect.x_to_cm(px, z))
-            y = self.z_to_pixel(z)
-            ctx.move_to(x, y)
-            for px, _, z in raw_data[1:]:
-                x = self.x_to_pixel(-kinect.x_to_cm(px, z))
-                y = self.z_to_pixel(z)
+            ctx.move_to(*outline[0])
+            for x, y in outline[1:]:
                 ctx.line_to(x, y)
             ctx.set_line_width(0.5)
             ctx.set_source_rgb(0.7, 0.0, 0.0)
@@ -361,10 +579,10 @@ class GameSceneArea(gtk.DrawingArea):
 class KinectTestWindow(gtk.Window):
 
     DATA_DIR = 'data/'
-    REFRESH_DELAY = 500  # ms
 
     def __init__(self):
         self._paused = True
+        self._producer = None
 
         gtk.Window.__init__(self)
         self.set_default_size(1280, 960)
@@ -382,6 +600,7 @@ class KinectTestWindow(gtk.Window):
         # Game scheme representation.
         game_scene = GameSceneArea((640, 480))
         self._display.add_observer(game_scene)
+        game_scene.follow(self._display.events)
         hbox.pack_start(game_scene)
 
         button_vbox = gtk.VBox()
@@ -398,18 +617,23 @@ class KinectTestWindow(gtk.Window):
         button_vbox.pack_start(self.save)
         self.save.connect("clicked", self._save_cb)
 
+        # Depth map palette.
+        self.palette = gtk.combo_box_new_text()
+        for i, name in enumerate(sorted(kinect_image.PALETTES)):
+            self.palette.append_text(name)
+            if name == 'gray':
+                self.palette.set_active(i)
+        button_vbox.pack_start(self.palette)
+        self.palette.connect("changed", self._palette_cb)
+
         # Pause/Autorefresh button.
         self.pause = gtk.Button('Pause', gtk.STOCK_MEDIA_PAUSE)
         button_vbox.pack_start(self.pause)
         self.pause.connect("clicked", self._pause_cb)
 
-        self.connect("destroy", gtk.main_quit)
+        self.connect("destroy", self._destroy_cb)
         self.show_all()
 
-        # Auto-refresh at 10 frames per seconds.
-        self.timer_id = gobject.timeout_add(self.REFRESH_DELAY,
-                self._timedout)
-
     def _choose_cb(self, widget, data=None):
         # Create file chooser.
         dialog = gtk.FileChooserDialog("Open...",
@@ -449,6 +673,9 @@ class KinectTestWindow(gtk.Window):
         numpy.save(self.DATA_DIR + fname_base + '_depth', depth)
         print 'Saved with "%s" base filename' % fname_base
 
+    def _palette_cb(self, widget, data=None):
+        self._display.set_palette(widget.get_active_text())
+
     def _pause_cb(self, widget, data=None):
         self._paused = not self._paused
         self.save.set_sensitive(self._paused)
@@ -456,34 +683,34 @@ class KinectTestWindow(gtk.Window):
 
         if not self._paused:
             self.pause.set_label(gtk.STOCK_MEDIA_PAUSE)
-            # Try to prevent unwanted redraw.
-            if not data:
-                self._display.refresh_data()
-                self.queue_draw()
-            self.timer_id = gobject.timeout_add(self.REFRESH_DELAY,
-                    self._timedout)
+            # Capture and analysis run in the background.
+            self._producer = FrameProducer(self._frame_cb).start()
         else:
             self.pause.set_label(gtk.STOCK_REFRESH)
+            if self._producer is not None:
+                self._producer.stop()
+                self._producer = None
 
-    def _timedout(self):
+    def _frame_cb(self, frame):
         # Stop auto refresh if no Kinect is detected.
-        found_kinect, _, _ = kinect.get_buffers()
-        if found_kinect:
-            self._display.refresh_data()
+        if frame.found_kinect:
+            self._display.show_frame(frame)
             self.queue_draw()
-        else:
-            if not self._paused:
-                print 'No Kinect found, stopping auto-refresh'
-                self._pause_cb(None, True)
+        elif not self._paused:
+            print 'No Kinect found, stopping auto-refresh'
+            self._pause_cb(None, True)
 
-        # Timer is repeated until False is returned.
-        return not self._paused
+    def _destroy_cb(self, widget, data=None):
+        if self._producer is not None:
+            self._producer.stop()
+        gtk.main_quit()
 
     def run(self):
         gtk.main()
 
 
 def main():
+    gobject.threads_init()
     KinectTestWindow().run()
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+"""
+kinect_image.py
+
+Conversion of Kinect buffers to images for display.
+
+Images are (height, width, 4) uint8 arrays laid out as cairo ARGB32 pixels on
+a little endian machine, i.e. B, G, R, A bytes. Only numpy is needed here.
+
+Conversions take an optional out image to write to, for instance a view of
+the data of a persistent cairo surface (see argb32_view), so that a frame
+costs no allocation.
+
+Depth maps are colored through a look up table of the 2048 raw depths: see
+PALETTES and DepthColormap.
+
+Obstacle outlines are drawn from whole arrays of pixels: see top_view_pixels
+and decimate.
+
+"""
+
+import numpy
+
+import kinect
+
+__all__ = ['argb32_view',
+           'rgb_to_argb32',
+           'depth_to_argb32',
+           'PALETTES',
+           'DepthColormap',
+           'top_view_pixels',
+           'decimate']
+
+_OPAQUE = numpy.uint32(0xff000000)
+_UNDEF_PIXEL = numpy.uint32(0xff008000)  # Green.
+
+
+def argb32_view(data, width, height):
+    '''(height, width, 4) uint8 image over the writable buffer of ARGB32
+    pixels data, e.g. cairo.ImageSurface.get_data(). ARGB32 rows are never
+    padded: the stride of such surfaces is width * 4.'''
+    return numpy.frombuffer(data, numpy.uint8, height * width * 4).reshape(
+            height, width, 4)
+
+
+def _pixels(image):
+    "(height, width) uint32 view of an image"
+    return image.view(numpy.uint32)[:, :, 0]
+
+
+def rgb_to_argb32(rgb, out=None):
+    "RGB bitmap to an opaque ARGB32 image"
+    if out is None:
+        out = numpy.empty(rgb.shape[:2] + (4,), numpy.uint8)
+    out[:, :, 2::-1] = rgb
+    out[:, :, 3] = 255
+    return out
+
+
+# ----------------------------------------------
+# Depth palettes.
+#
+# A palette takes the auto-range bounds of a frame (raw depths low, high)
+# and returns the (2048,) uint32 look up table of the ARGB32 pixel of each
+# raw depth. The pixel of UNDEF_DEPTH is set afterwards.
+
+_RAW_DEPTHS = numpy.arange(kinect.UNDEF_DEPTH + 1)
+
+
+def _rgb_lut(r, g, b):
+    "opaque pixels from channels in [0, 255]"
+    lut = r.astype(numpy.uint32) << 16
+    lut |= g.astype(numpy.uint32) << 8
+    lut |= b.astype(numpy.uint32)
+    lut |= _OPAQUE
+    return lut
+
+
+def _gray(low, high):
+    "closer is lighter"
+    gray = (255 - (_RAW_DEPTHS - low) * 254.0 / max(high - low, 1)).clip(
+            0, 255)
+    return _rgb_lut(gray, gray, gray)
+
+
+def _jet(low, high):
+    "closer is red, farther is blue"
+    t = 1.0 - ((_RAW_DEPTHS - low) / float(max(high - low, 1))).clip(0.0, 1.0)
+    r, g, b = [(255 * (1.5 - numpy.abs(4.0 * t - shift))).clip(0, 255)
+               for shift in (3.0, 2.0, 1.0)]
+    return _rgb_lut(r, g, b)
+
+
+_BAND_WIDTH = 25.0  # cm
+
+
+def _bands(low, high):
+    '''bands of _BAND_WIDTH cm between _MIN_DISTANCE and _MAX_DISTANCE,
+    closer is warmer, dark red out of range. Does not depend on the frame.'''
+    distance = kinect._dist_values
+    t = ((distance - kinect._MIN_DISTANCE)
+         / (kinect._MAX_DISTANCE - kinect._MIN_DISTANCE)).clip(0.0, 1.0)
+    shade = numpy.where(
+        (distance // _BAND_WIDTH) % 2 == 0, 1.0, 0.75)
+    r = 255 * shade * (1.0 - t)
+    g = 255 * shade * (1.0 - numpy.abs(2.0 * t - 1.0))
+    b = 255 * shade * t
+    out_of_range = (distance < kinect._MIN_DISTANCE) \
+            | (distance >= kinect._MAX_DISTANCE)
+    r[out_of_range], g[out_of_range], b[out_of_range] = 96, 0, 0
+    return _rgb_lut(r, g, b)
+
+
+PALETTES = {
+    'gray': _gray,
+    'jet': _jet,
+    'bands': _bands,
+    }
+
+# Palettes that do not use the bounds of the frame.
+_FIXED_PALETTES = ('bands',)
+
+
+def _bounds(depth):
+    "auto-range bounds: lowest raw depth and highest defined one"
+    low = numpy.amin(depth)
+    high = numpy.amax(numpy.where(depth == kinect.UNDEF_DEPTH, 0, depth))
+    return int(low), int(high)
+
+
+def _lut(palette, low, high):
+    lut = PALETTES[palette](low, high)
+    lut[kinect.UNDEF_DEPTH] = _UNDEF_PIXEL
+    return lut
+
+
+def _apply(lut, depth, out):
+    if out is None:
+        out = numpy.empty(depth.shape + (4,), numpy.uint8)
+    numpy.take(lut, depth, out=_pixels(out), mode='clip')
+    return out
+
+
+def depth_to_argb32(depth, out=None, palette='gray'):
+    '''Depth map to an ARGB32 image, auto-ranged on the depths of the map.
+    In the default gray palette, closer is lighter. Undefined depth
+    (UNDEF_DEPTH) is shown green. See DepthColormap to convert successive
+    frames.'''
+    low, high = _bounds(depth)
+    return _apply(_lut(palette, low, high), depth, out)
+
+
+class DepthColormap(object):
+    '''Colors successive depth maps with a palette.
+
+    colormap = DepthColormap(palette='gray', threshold=16, stride=1)
+        palette:    name of the palette, see PALETTES
+        threshold:  raw depth by which the auto-range bounds must move for
+                    the look up table to be rebuilt
+        stride:     auto-range bounds are searched on one pixel out of
+                    stride in both directions
+
+    colormap(depth, out=None) returns the ARGB32 image of a depth map: one
+    numpy.take of its depths in the look up table. With threshold=0 and
+    stride=1, images are depth_to_argb32's.
+    '''
+
+    def __init__(self, palette='gray', threshold=16, stride=1):
+        if palette not in PALETTES:
+            raise ValueError('unknown palette %r' % palette)
+        self.palette = palette
+        self.threshold = threshold
+        self.stride = stride
+        self.bounds = None
+        self.lut = None
+        self.rebuilds = 0
+
+    def __call__(self, depth, out=None):
+        if self.palette in _FIXED_PALETTES:
+            if self.lut is None:
+                self._rebuild(None)
+        else:
+            low, high = _bounds(depth[::self.stride, ::self.stride])
+            if self.bounds is None \
+                    or abs(low - self.bounds[0]) > self.threshold \
+                    or abs(high - self.bounds[1]) > self.threshold:
+                self._rebuild((low, high))
+        return _apply(self.lut, depth, out)
+
+    def _rebuild(self, bounds):
+        self.bounds = bounds
+        self.lut = _lut(self.palette, *(bounds or (0, 0)))
+        self.rebuilds += 1
+
+
+# ----------------------------------------------
+# Top view polylines.
+
+def top_view_pixels(x, z, px_per_cm, origin=(320, 480)):
+    '''(n, 2) int array of the pixels of top view points x, z in cm. The
+    kinect is at the origin pixel, z goes up. Same rounding as per point
+    int(x * px_per_cm) + 320 and 480 - int(z * px_per_cm).'''
+    pixels = numpy.empty((len(x), 2), int)
+    numpy.multiply(x, px_per_cm, out=pixels[:, 0], casting='unsafe')
+    numpy.multiply(z, px_per_cm, out=pixels[:, 1], casting='unsafe')
+    pixels[:, 0] += origin[0]
+    numpy.subtract(origin[1], pixels[:, 1], out=pixels[:, 1])
+    return pixels
+
+
+def decimate(points, max_vertices=None, tolerance=0.0):
+    '''Simplifies an (n, 2) polyline.
+    decimate(points, max_vertices=None, tolerance=0.0):
+        points:         vertices of the polyline
+        max_vertices:   at most this many vertices are kept, the first and
+                        last ones always
+        tolerance:      vertices closer than this to the simplified line
+                        may be dropped
+
+        returns the kept vertices, and the largest distance of a dropped
+        vertex to the simplified line.
+
+    Vertices are added from the end points on, the farthest from the
+    simplified line first, until it is within tolerance or max_vertices
+    are kept.
+    '''
+    n = len(points)
+    limit = n if max_vertices is None else max(max_vertices, 2)
+    if n <= 2:
+        return points, 0.0
+
+    p = numpy.asarray(points, float)
+    indices = numpy.arange(n)
+    kept = numpy.zeros(n, bool)
+    kept[0] = kept[-1] = True
+    count = 2
+    while True:
+        # Segment of the simplified line around each vertex.
+        start = numpy.maximum.accumulate(numpy.where(kept, indices, 0))
+        stop = numpy.minimum.accumulate(
+            numpy.where(kept, indices, n - 1)[::-1])[::-1]
+        a = p[start]
+        ab = p[stop] - a
+        ap = p - a
+        length = (ab * ab).sum(axis=1)
+        t = (ap * ab).sum(axis=1) / numpy.where(length > 0, length, 1.0)
+        t = t.clip(0.0, 1.0)
+        distance = numpy.hypot(*(ap - t[:, None] * ab).T)
+        distance[kept] = 0.0
+
+        farthest = numpy.argmax(distance)
+        error = distance[farthest]
+        if error <= tolerance or count >= limit:
+            return points[kept], error
+        kept[farthest] = True
+        count += 1
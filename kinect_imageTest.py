@@ -0,0 +1,151 @@
+import unittest
+import numpy
+import kinect
+import kinect_image
+
+
+class ImageTest (unittest.TestCase):
+
+    def test_rgb_to_argb32(self):
+        rgb = numpy.zeros((2, 3, 3), numpy.uint8)
+        rgb[0, 1] = 10, 20, 30
+        image = kinect_image.rgb_to_argb32(rgb)
+        self.assertEqual(image.shape, (2, 3, 4))
+        self.assertEqual(list(image[0, 1]), [30, 20, 10, 255])
+
+    def test_depth_to_argb32(self):
+        depth = numpy.array([[500, 600, kinect.UNDEF_DEPTH]], numpy.uint16)
+        image = kinect_image.depth_to_argb32(depth)
+        self.assertEqual(list(image[0, 0]), [255, 255, 255, 255])
+        self.assertEqual(list(image[0, 1]), [1, 1, 1, 255])
+        self.assertEqual(list(image[0, 2]), [0, 128, 0, 255])
+
+    def test_in_place(self):
+        data = bytearray(2 * 3 * 4 + 4)
+        image = kinect_image.argb32_view(data, 3, 2)
+        self.assertEqual(image.shape, (2, 3, 4))
+        depth = numpy.array([[500, 600, kinect.UNDEF_DEPTH],
+                             [550, 600, 600]], numpy.uint16)
+        self.assertTrue(kinect_image.depth_to_argb32(depth, out=image)
+                        is image)
+        self.assertEqual(list(data[:12]), [255, 255, 255, 255, 1, 1, 1, 255,
+                                           0, 128, 0, 255])
+        self.assertEqual(list(data[-4:]), [0, 0, 0, 0])
+        rgb = numpy.zeros((2, 3, 3), numpy.uint8)
+        rgb[1, 2] = 10, 20, 30
+        kinect_image.rgb_to_argb32(rgb, out=image)
+        self.assertEqual(list(data[20:24]), [30, 20, 10, 255])
+
+    def test_recorded_frames(self):
+        # Same images as the per-channel conversion.
+        for name in ('data/2012-03-02_14-36-48', 'data/2012-03-30_14-14-43'):
+            depth = numpy.load(name + '_depth.npy')
+            alpha = numpy.ones(depth.shape + (1,), dtype=numpy.uint8) * 255
+            i = numpy.amin(depth)
+            a = numpy.amax(numpy.where(depth == kinect.UNDEF_DEPTH, 0, depth))
+            gray = numpy.where(depth == kinect.UNDEF_DEPTH, 0,
+                               255 - (depth - i) * 254.0 / (a - i))
+            expected = numpy.dstack((alpha, gray, numpy.where(
+                gray == 0, 128, gray), gray))[:, :, ::-1].astype(numpy.uint8)
+            self.assertTrue((kinect_image.depth_to_argb32(depth)
+                             == expected).all())
+
+
+class DepthColormapTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = [numpy.load(name + '_depth.npy') for name in (
+            'data/2012-03-02_14-36-48', 'data/2012-03-23_12-55-38')]
+
+    def test_exact(self):
+        colormap = kinect_image.DepthColormap(threshold=0)
+        for depth in self.depths:
+            self.assertTrue((colormap(depth)
+                             == kinect_image.depth_to_argb32(depth)).all())
+        self.assertEqual(colormap.rebuilds, 2)
+
+    def test_threshold(self):
+        colormap = kinect_image.DepthColormap('jet', threshold=16)
+        depth = self.depths[0].copy()
+        image = colormap(depth)
+        low, high = colormap.bounds
+        # Bounds moving less than the threshold keep the table.
+        depth[0, 0] = high + 10
+        self.assertTrue(colormap(depth, out=image) is image)
+        self.assertEqual((colormap.rebuilds, colormap.bounds), (1, (low, high)))
+        depth[0, 0] = high + 20
+        colormap(depth, out=image)
+        self.assertEqual((colormap.rebuilds, colormap.bounds),
+                         (2, (low, high + 20)))
+
+    def test_palettes(self):
+        depth = self.depths[1]
+        undefined = depth == kinect.UNDEF_DEPTH
+        for palette in kinect_image.PALETTES:
+            colormap = kinect_image.DepthColormap(palette, stride=4)
+            image = colormap(depth)
+            colormap(self.depths[0])
+            self.assertTrue((image[:, :, 3] == 255).all(), palette)
+            self.assertTrue((image[undefined] == (0, 128, 0, 255)).all())
+            self.assertTrue(len(numpy.unique(colormap.lut)) > 50, palette)
+        self.assertEqual(colormap.rebuilds, 1)
+        self.assertRaises(ValueError, kinect_image.DepthColormap, 'none')
+
+    def test_jet(self):
+        image = kinect_image.depth_to_argb32(
+            numpy.array([[500, 700, 900]], numpy.uint16), palette='jet')
+        # Closer is red, farther is blue, BGRA bytes.
+        self.assertEqual(list(image[0, 0]), [0, 0, 127, 255])
+        self.assertEqual(list(image[0, 1]), [127, 255, 127, 255])
+        self.assertEqual(list(image[0, 2]), [127, 0, 0, 255])
+
+
+class TopViewTest (unittest.TestCase):
+
+    def test_top_view_pixels(self):
+        x = numpy.array([-10.3, 5.7, 0.0, -0.4, 120.0])
+        z = numpy.array([100.2, 3.0, 0.0, 250.9, 44.4])
+        pixels = kinect_image.top_view_pixels(x, z, 1.6)
+        expected = [[int(a * 1.6) + 320, 480 - int(b * 1.6)]
+                    for a, b in zip(x, z)]
+        self.assertEqual(pixels.tolist(), expected)
+
+    def distance_to_line(self, points, line):
+        "Largest distance of points to the polyline, brute force"
+        worst = 0.0
+        for p in points:
+            best = numpy.inf
+            for a, b in zip(line[:-1], line[1:]):
+                ab = b - a
+                t = numpy.clip(float(numpy.dot(p - a, ab))
+                               / max(numpy.dot(ab, ab), 1e-12), 0.0, 1.0)
+                best = min(best, numpy.hypot(*(p - a - t * ab)))
+            worst = max(worst, best)
+        return worst
+
+    def test_decimate(self):
+        angles = numpy.linspace(0, numpy.pi, 50)
+        points = numpy.column_stack((numpy.cos(angles), numpy.sin(angles)))
+        points = (points * 100).astype(int)
+        for max_vertices in (2, 3, 5, 10):
+            kept, error = kinect_image.decimate(points, max_vertices)
+            self.assertEqual(len(kept), max_vertices)
+            self.assertEqual(kept[0].tolist(), points[0].tolist())
+            self.assertEqual(kept[-1].tolist(), points[-1].tolist())
+            self.assertAlmostEqual(error, self.distance_to_line(points, kept))
+        kept, error = kinect_image.decimate(points, tolerance=2.0)
+        self.assertTrue(error <= 2.0)
+        self.assertTrue(len(kept) < len(points))
+        self.assertAlmostEqual(error, self.distance_to_line(points, kept))
+
+    def test_decimate_line(self):
+        points = numpy.column_stack((numpy.arange(10), 2 * numpy.arange(10)))
+        kept, error = kinect_image.decimate(points, 5)
+        self.assertEqual(kept.tolist(), [[0, 0], [9, 18]])
+        self.assertEqual(error, 0.0)
+        kept, error = kinect_image.decimate(points[:2], 5)
+        self.assertEqual(len(kept), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
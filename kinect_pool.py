@@ -0,0 +1,154 @@
+"""
+kinect_pool.py
+
+Obstacle extraction for several sensors, in one worker process per sensor.
+
+Frames are handed to workers through shared memory: the analysis band of each
+submitted depth frame is copied into a slot of a shared buffer, and only the
+slot number goes through a queue. Workers write their obstacles as compact
+float32 arrays into shared output slots in the same way.
+
+"""
+
+from collections import namedtuple
+import multiprocessing
+import Queue
+
+import numpy
+
+import kinect
+
+__all__ = ['SensorPool',
+           'SensorResult',
+           'OBSTACLE_FIELDS',
+           'obstacles_to_array',
+           'array_to_obstacles']
+
+# Columns of compact obstacle arrays.
+OBSTACLE_FIELDS = ('x', 'y', 'width', 'height', 'z')
+
+# Returned by SensorPool.get_result
+#
+# sensor        Sensor number
+# index         Frame index given to submit
+# obstacles     (n, 5) float32 array, see OBSTACLE_FIELDS
+SensorResult = namedtuple('SensorResult', 'sensor index obstacles')
+
+
+def obstacles_to_array(obstacles, out=None):
+    "Obstacle list to an (n, 5) float32 array, raw data is dropped."
+    if out is None:
+        out = numpy.empty((len(obstacles), len(OBSTACLE_FIELDS)),
+                          numpy.float32)
+    for row, obstacle in zip(out, obstacles):
+        row[:] = obstacle[:len(OBSTACLE_FIELDS)]
+    return out
+
+
+def array_to_obstacles(array):
+    "(n, 5) obstacle array back to an Obstacle list, without raw data."
+    return [kinect.Obstacle(*(tuple(row) + (None,))) for row in array]
+
+
+def _worker(sensor, band, dtype, frames, outputs, requests, results):
+    "Worker process main loop."
+    bx, by, bw, bh = band
+    frames = numpy.frombuffer(frames, numpy.uint16).reshape(-1, bh, bw)
+    outputs = numpy.frombuffer(outputs, numpy.float32).reshape(
+            len(frames), bw, len(OBSTACLE_FIELDS))
+    processor = kinect.DepthProcessor(band, dtype)
+
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        slot, index = request
+        obstacles = processor.extract_obstacles(frames[slot])
+        obstacles_to_array(obstacles, outputs[slot])
+        results.put((sensor, index, slot, len(obstacles)))
+
+
+class SensorPool(object):
+    '''Extracts obstacles of several sensors in parallel processes.
+
+    pool = SensorPool(sensors, band=..., slots=2, dtype=numpy.float32)
+        sensors:    number of sensors, one worker process each
+        band:       analysis band in pixels (x, y, w, h)
+        slots:      frames of a sensor that can be in the pool at once
+
+    submit() a depth frame of a sensor, then get_result() the obstacles of
+    any sensor as they are ready.
+    '''
+
+    def __init__(self, sensors, band=kinect._DEFAULT_ANALYSIS_BAND, slots=2,
+                 dtype=numpy.float32):
+        self.band = band
+        bx, by, bw, bh = band
+        # At most one obstacle per column.
+        output_size = slots * bw * len(OBSTACLE_FIELDS)
+
+        self._frames = []
+        self._outputs = []
+        self._requests = []
+        self._free = []
+        self._results = multiprocessing.Queue()
+        self._workers = []
+        for sensor in xrange(sensors):
+            frames = multiprocessing.RawArray('H', slots * bh * bw)
+            outputs = multiprocessing.RawArray('f', output_size)
+            requests = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=_worker,
+                name='kinect-sensor-%d' % sensor,
+                args=(sensor, band, dtype, frames, outputs, requests,
+                      self._results))
+            worker.daemon = True
+            worker.start()
+
+            self._frames.append(
+                numpy.frombuffer(frames, numpy.uint16).reshape(-1, bh, bw))
+            self._outputs.append(
+                numpy.frombuffer(outputs, numpy.float32).reshape(
+                    slots, bw, len(OBSTACLE_FIELDS)))
+            self._requests.append(requests)
+            self._free.append(range(slots))
+            self._workers.append(worker)
+
+    def __len__(self):
+        return len(self._workers)
+
+    def submit(self, sensor, depth, index=None):
+        '''Hands a depth frame (full frame or cropped to the band) of a sensor
+        to its worker. Returns False, and drops the frame, if the worker is
+        late and all the slots of the sensor are in use.'''
+        if not self._free[sensor]:
+            return False
+        slot = self._free[sensor].pop(0)
+        self._frames[sensor][slot] = kinect.crop_band(depth, self.band)
+        self._requests[sensor].put((slot, index))
+        return True
+
+    def get_result(self, timeout=None):
+        '''Returns the next SensorResult, from any sensor. Returns None if
+        there is none before timeout seconds.'''
+        try:
+            sensor, index, slot, count = self._results.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        obstacles = self._outputs[sensor][slot, :count].copy()
+        self._free[sensor].append(slot)
+        return SensorResult(sensor, index, obstacles)
+
+    def close(self):
+        "Stops the workers."
+        for requests in self._requests:
+            requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,73 @@
+import unittest
+import numpy
+import kinect
+import kinect_pool
+
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+
+class SensorPoolTest (unittest.TestCase):
+
+    def setUp(self):
+        self.depths = [numpy.load(f + '_depth.npy') for f in DATA_FILES]
+        self.processor = kinect.DepthProcessor()
+
+    def expected(self, depth):
+        return kinect_pool.obstacles_to_array(
+            self.processor.extract_obstacles(depth))
+
+    def test_sensors(self):
+        with kinect_pool.SensorPool(len(self.depths)) as pool:
+            for sensor, depth in enumerate(self.depths):
+                self.assertTrue(pool.submit(sensor, depth, 10 + sensor))
+            results = [pool.get_result(timeout=5.0) for depth in self.depths]
+        self.assertEqual(sorted(r.sensor for r in results), [0, 1, 2, 3])
+        for result in results:
+            self.assertEqual(result.index, 10 + result.sensor)
+            self.assertTrue((result.obstacles
+                             == self.expected(self.depths[result.sensor])
+                             ).all())
+
+    def test_slots(self):
+        with kinect_pool.SensorPool(1, slots=2) as pool:
+            self.assertTrue(pool.submit(0, self.depths[0], 0))
+            self.assertTrue(pool.submit(0, self.depths[1], 1))
+            self.assertFalse(pool.submit(0, self.depths[2], 2))
+            result = pool.get_result(timeout=5.0)
+            self.assertEqual(result.index, 0)
+            self.assertTrue(pool.submit(0, self.depths[3], 3))
+            self.assertEqual([pool.get_result(timeout=5.0).index,
+                              pool.get_result(timeout=5.0).index], [1, 3])
+            self.assertTrue(pool.get_result(timeout=0.1) is None)
+
+    def test_replayed_sensors(self):
+        grabbers = [kinect.FrameGrabber(kinect.FakeDevice([f], rate=100.0),
+                                        streams=(kinect.DEPTH_STREAM,)).start()
+                    for f in DATA_FILES[:3]]
+        try:
+            with kinect_pool.SensorPool(len(grabbers)) as pool:
+                for sensor, grabber in enumerate(grabbers):
+                    frame = grabber.next_frame(timeout=1.0)
+                    pool.submit(sensor, frame.depth, frame.index)
+                for i in xrange(len(grabbers)):
+                    result = pool.get_result(timeout=5.0)
+                    self.assertEqual(len(result.obstacles), len(
+                        self.expected(self.depths[result.sensor])))
+        finally:
+            for grabber in grabbers:
+                grabber.stop()
+
+    def test_array_to_obstacles(self):
+        obstacles = self.processor.extract_obstacles(self.depths[3])
+        back = kinect_pool.array_to_obstacles(
+            kinect_pool.obstacles_to_array(obstacles))
+        self.assertEqual(len(back), len(obstacles))
+        self.assertTrue(back[0].raw_data is None)
+        self.assertEqual(back[0][:5], obstacles[0][:5])
+
+
+if __name__ == '__main__':
+    unittest.main()
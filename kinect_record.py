@@ -0,0 +1,380 @@
+"""
+kinect_record.py
+
+Recording and replay of Kinect sessions.
+
+A recording is a single append-only file:
+ - a 32 bytes header: magic, version, recorded streams, frame size,
+ - then one fixed size chunk per frame: frame index, timestamp, raw uint16
+   depth plane and/or uint8 RGB plane.
+
+As every chunk has the same size, frame N is found at a known offset: replay
+maps the file with numpy.memmap and returns views into it, without reading
+nor copying anything else. A trailing chunk left incomplete by an interrupted
+recording is ignored.
+
+Compressed depth recordings, for archiving long sessions, hold the depth
+stream only:
+ - a 16 bytes header: magic, version, frame size,
+ - then one chunk per frame: frame index, timestamp, key frame flag, payload
+   size, and the payload. The payload is the difference to the previous
+   frame (to zero for key frames) modulo 2048, packed on 11 bits (depth is
+   at most UNDEF_DEPTH = 2047) and compressed with zlib.
+They are read sequentially by read_depth_frames.
+
+"""
+
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy
+
+import kinect
+
+__all__ = ['Recorder',
+           'Recording',
+           'RecordingDevice',
+           'import_npy',
+           'DepthRecorder',
+           'read_depth_frames',
+           'EXTENSION',
+           'DEPTH_EXTENSION']
+
+EXTENSION = '.krec'
+DEPTH_EXTENSION = '.kdz'
+
+_MAGIC = 'KREC'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHII16x')  # magic version streams width height
+
+_DEPTH_FLAG = 1
+_RGB_FLAG = 2
+
+
+def _chunk_dtype(flags, width, height):
+    "numpy description of one frame chunk"
+    fields = [('index', '<u4'), ('reserved', '<u4'), ('timestamp', '<f8')]
+    if flags & _DEPTH_FLAG:
+        fields.append(('depth', '<u2', (height, width)))
+    if flags & _RGB_FLAG:
+        fields.append(('rgb', 'u1', (height, width, 3)))
+    return numpy.dtype(fields)
+
+
+class Recorder(object):
+    '''Appends frames to a recording file, created if needed.
+
+    recorder = Recorder(filename, streams=kinect.ALL_STREAMS, size=(640, 480))
+        streams:    recorded streams (kinect.RGB_STREAM, kinect.DEPTH_STREAM)
+        size:       frame size in pixels (width, height)
+
+    When appending to an existing file, its streams and size are used.
+    '''
+
+    def __init__(self, filename, streams=kinect.ALL_STREAMS, size=(640, 480)):
+        self.filename = filename
+        if os.path.exists(filename) and os.path.getsize(filename):
+            recording = Recording(filename)
+            self._dtype = recording.dtype
+            self._count = len(recording)
+            # Close the mapping first: a mapped file cannot be truncated on
+            # Windows. Then drop an incomplete trailing chunk.
+            del recording
+            self._file = open(filename, 'r+b')
+            self._file.truncate(
+                    _HEADER.size + self._count * self._dtype.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            flags = 0
+            if kinect.DEPTH_STREAM in streams:
+                flags |= _DEPTH_FLAG
+            if kinect.RGB_STREAM in streams:
+                flags |= _RGB_FLAG
+            width, height = size
+            self._dtype = _chunk_dtype(flags, width, height)
+            self._count = 0
+            self._file = open(filename, 'wb')
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION, flags,
+                                          width, height))
+        self._chunk = numpy.zeros(1, self._dtype)
+
+    def __len__(self):
+        return self._count
+
+    def write(self, depth=None, rgb=None, timestamp=None):
+        '''Appends a frame, returns its index.
+        Streams that are recorded must be given.'''
+        chunk = self._chunk
+        chunk['index'] = self._count
+        chunk['timestamp'] = time.time() if timestamp is None else timestamp
+        if 'depth' in self._dtype.names:
+            chunk['depth'] = depth
+        if 'rgb' in self._dtype.names:
+            chunk['rgb'] = rgb
+        self._file.write(self._chunk.tostring())
+        self._count += 1
+        return self._count - 1
+
+    def write_frame(self, frame):
+        "Appends a kinect.KinectFrame, keeping its timestamp."
+        return self.write(frame.depth, frame.rgb, frame.timestamp)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Recording(object):
+    '''Memory mapped, read only recording.
+
+    recording[n] is a kinect.KinectFrame whose planes are views into the
+    file. Streams that were not recorded are None.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError('%s: not a Kinect recording' % filename)
+        magic, version, flags, width, height = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('%s: not a Kinect recording' % filename)
+
+        self.size = width, height
+        self.dtype = _chunk_dtype(flags, width, height)
+        count = (os.path.getsize(filename) - _HEADER.size) \
+                // self.dtype.itemsize
+        if count:
+            self._chunks = numpy.memmap(filename, dtype=self.dtype, mode='r',
+                                        offset=_HEADER.size, shape=(count,))
+        else:
+            # Empty files can not be mapped.
+            self._chunks = numpy.zeros(0, self.dtype)
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __getitem__(self, n):
+        chunks = self._chunks
+        names = self.dtype.names
+        return kinect.KinectFrame(
+            real_kinect=False,
+            rgb=chunks['rgb'][n] if 'rgb' in names else None,
+            depth=chunks['depth'][n] if 'depth' in names else None,
+            index=int(chunks['index'][n]),
+            timestamp=float(chunks['timestamp'][n]))
+
+    def __iter__(self):
+        for n in xrange(len(self)):
+            yield self[n]
+
+    @property
+    def timestamps(self):
+        return self._chunks['timestamp']
+
+
+class RecordingDevice(object):
+    '''Replays a recording through kinect.FrameGrabber, at its own pace
+    (rate=None) or at a given rate in frames per second, looping over it.'''
+
+    real_kinect = False
+
+    def __init__(self, filename, rate=None):
+        self._recording = Recording(filename)
+        self._rate = rate
+
+    def run(self, on_depth, on_video, stopped):
+        count = len(self._recording)
+        if not count:
+            return
+        if self._rate:
+            delays = numpy.arange(1, count + 1) / float(self._rate)
+        else:
+            # Recorded pace, and a 30 Hz frame period before looping.
+            timestamps = self._recording.timestamps
+            delays = timestamps - timestamps[0] + 1 / 30.0
+        while not stopped.is_set():
+            start = time.time()
+            for delay, frame in zip(delays, self._recording):
+                if stopped.wait(max(0.0, start + delay - time.time())):
+                    return
+                if on_video:
+                    on_video(frame.rgb)
+                if on_depth:
+                    on_depth(frame.depth)
+
+
+# ----------------------------------------------
+# Compressed depth recordings.
+
+_DEPTH_MAGIC = 'KDZ1'
+_DEPTH_HEADER = struct.Struct('<4sHHII')  # magic version width height pad
+_DEPTH_CHUNK = struct.Struct('<IdBxxxI')  # index timestamp key size
+
+_DEPTH_BITS = 11
+_DEPTH_MASK = (1 << _DEPTH_BITS) - 1  # kinect.UNDEF_DEPTH
+
+
+def _pack_11bit(values):
+    "Packs uint16 values lower than 2048 as a string of 11 bits values."
+    bits = numpy.unpackbits(values.astype('>u2').view(numpy.uint8))
+    return numpy.packbits(bits.reshape(-1, 16)[:, 16 - _DEPTH_BITS:]) \
+            .tostring()
+
+
+def _unpack_11bit(data, count):
+    "Unpacks count 11 bits values as an uint16 array."
+    bits = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8))
+    words = numpy.zeros((count, 16), numpy.uint8)
+    words[:, 16 - _DEPTH_BITS:] = bits[:count * _DEPTH_BITS].reshape(
+            count, _DEPTH_BITS)
+    return numpy.packbits(words).view('>u2').astype(numpy.uint16)
+
+
+class DepthRecorder(object):
+    '''Writes a compressed depth recording (see module documentation).
+
+    recorder = DepthRecorder(filename, size=(640, 480), key_interval=30,
+                             level=6)
+        key_interval:   a frame out of key_interval is stored without delta,
+                        bounding the loss on a damaged chunk
+        level:          zlib compression level
+    '''
+
+    def __init__(self, filename, size=(640, 480), key_interval=30, level=6):
+        self.filename = filename
+        self.size = size
+        self._key_interval = key_interval
+        self._level = level
+        self._previous = None
+        self._count = 0
+        self.raw_size = self.compressed_size = 0
+        self._file = open(filename, 'wb')
+        width, height = size
+        self._file.write(_DEPTH_HEADER.pack(_DEPTH_MAGIC, _VERSION,
+                                            0, width, height))
+
+    def __len__(self):
+        return self._count
+
+    def write(self, depth, timestamp=None):
+        "Appends a depth frame, returns its index."
+        depth = numpy.asarray(depth, numpy.uint16)
+        key = self._previous is None or self._count % self._key_interval == 0
+        if key:
+            delta = depth
+        else:
+            delta = (depth - self._previous) & _DEPTH_MASK
+        payload = zlib.compress(_pack_11bit(delta.ravel()), self._level)
+        self._file.write(_DEPTH_CHUNK.pack(
+            self._count,
+            time.time() if timestamp is None else timestamp,
+            key,
+            len(payload)))
+        self._file.write(payload)
+        self._previous = depth.copy()
+        self._count += 1
+        self.raw_size += depth.nbytes
+        self.compressed_size += _DEPTH_CHUNK.size + len(payload)
+        return self._count - 1
+
+    def write_frame(self, frame):
+        "Appends the depth of a kinect.KinectFrame, keeping its timestamp."
+        return self.write(frame.depth, frame.timestamp)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_depth_frames(filename):
+    '''Generator of the kinect.KinectFrame of a compressed depth recording,
+    decoded one at a time. Their rgb is None.'''
+    with open(filename, 'rb') as f:
+        header = f.read(_DEPTH_HEADER.size)
+        if len(header) < _DEPTH_HEADER.size:
+            raise ValueError('%s: not a Kinect depth recording' % filename)
+        magic, version, _, width, height = _DEPTH_HEADER.unpack(header)
+        if magic != _DEPTH_MAGIC or version != _VERSION:
+            raise ValueError('%s: not a Kinect depth recording' % filename)
+
+        count = width * height
+        previous = None
+        while True:
+            chunk = f.read(_DEPTH_CHUNK.size)
+            if len(chunk) < _DEPTH_CHUNK.size:
+                return
+            index, timestamp, key, size = _DEPTH_CHUNK.unpack(chunk)
+            payload = f.read(size)
+            if len(payload) < size:
+                return  # Interrupted recording.
+            depth = _unpack_11bit(zlib.decompress(payload), count)
+            depth = depth.reshape(height, width)
+            if not key:
+                depth += previous
+                depth &= _DEPTH_MASK
+            previous = depth
+            yield kinect.KinectFrame(
+                real_kinect=False,
+                rgb=None,
+                depth=depth,
+                index=index,
+                timestamp=timestamp)
+
+
+def import_npy(basename, filename=None):
+    '''Converts a data/*.npy pair (given without extension, see
+    kinect.set_default_data) to a one frame recording. Returns its filename.'''
+    if filename is None:
+        filename = basename + EXTENSION
+    rgb = numpy.load(basename + '_rgb.npy')
+    depth = numpy.load(basename + '_depth.npy')
+    if os.path.exists(filename):
+        os.remove(filename)
+    with Recorder(filename, size=(depth.shape[1], depth.shape[0])) as rec:
+        rec.write(depth, rgb, os.path.getmtime(basename + '_depth.npy'))
+    return filename
+
+
+def record(filename, duration, streams=kinect.ALL_STREAMS):
+    "Records duration seconds from the Kinect."
+    grabber = kinect.FrameGrabber(kinect.FreenectDevice(),
+                                  streams=streams).start()
+    try:
+        with Recorder(filename, streams) as recorder:
+            end = time.time() + duration
+            frame = grabber.next_frame(timeout=duration)
+            while frame is not None and frame.timestamp < end:
+                recorder.write_frame(frame)
+                frame = grabber.next_frame(frame.index, end - time.time())
+            print '%d frames recorded to %s' % (len(recorder), filename)
+    finally:
+        grabber.stop()
+
+if __name__ == '__main__':
+    "record DURATION seconds to FILE, or import the data/*.npy pairs"
+    if len(sys.argv) == 3:
+        record(sys.argv[1], float(sys.argv[2]))
+    else:
+        for f in ('2012-03-02_14-36-48',
+                '2012-03-23_12-55-38',
+                '2012-03-23_13-21-48',
+                '2012-03-30_14-14-43'):
+            print 'imported', import_npy('data/' + f)
@@ -0,0 +1,149 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import numpy
+import kinect
+import kinect_record
+
+DATA_FILE = 'data/2012-03-23_12-55-38'
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+
+class RecordingTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.krec')
+        self.depth = numpy.load(DATA_FILE + '_depth.npy')
+        self.rgb = numpy.load(DATA_FILE + '_rgb.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_read(self):
+        with kinect_record.Recorder(self.filename) as recorder:
+            for i in xrange(3):
+                recorder.write(self.depth + i, self.rgb, 10.0 + i)
+        recording = kinect_record.Recording(self.filename)
+        self.assertEqual(len(recording), 3)
+        frame = recording[2]
+        self.assertEqual((frame.index, frame.timestamp), (2, 12.0))
+        self.assertTrue((frame.depth == self.depth + 2).all())
+        self.assertTrue((frame.rgb == self.rgb).all())
+        self.assertEqual(list(recording.timestamps), [10.0, 11.0, 12.0])
+
+    def test_frames_are_mapped(self):
+        with kinect_record.Recorder(self.filename) as recorder:
+            recorder.write(self.depth, self.rgb)
+        frame = kinect_record.Recording(self.filename)[0]
+        self.assertTrue(isinstance(frame.depth, numpy.memmap))
+        self.assertFalse(frame.depth.flags.writeable)
+
+    def test_depth_only(self):
+        with kinect_record.Recorder(self.filename,
+                                    (kinect.DEPTH_STREAM,)) as recorder:
+            recorder.write(self.depth)
+        frame = kinect_record.Recording(self.filename)[0]
+        self.assertTrue(frame.rgb is None)
+        self.assertTrue((frame.depth == self.depth).all())
+
+    def test_append_after_truncation(self):
+        with kinect_record.Recorder(self.filename) as recorder:
+            recorder.write(self.depth, self.rgb)
+            recorder.write(self.depth, self.rgb)
+        # Simulate an interrupted recording.
+        with open(self.filename, 'r+b') as f:
+            f.truncate(os.path.getsize(self.filename) - 1000)
+        self.assertEqual(len(kinect_record.Recording(self.filename)), 1)
+
+        with kinect_record.Recorder(self.filename) as recorder:
+            self.assertEqual(recorder.write(self.depth, self.rgb), 1)
+        recording = kinect_record.Recording(self.filename)
+        self.assertEqual([frame.index for frame in recording], [0, 1])
+
+    def test_import_npy(self):
+        kinect_record.import_npy(DATA_FILE, self.filename)
+        recording = kinect_record.Recording(self.filename)
+        self.assertEqual(len(recording), 1)
+        self.assertTrue((recording[0].depth == self.depth).all())
+        self.assertTrue((recording[0].rgb == self.rgb).all())
+
+    def test_not_a_recording(self):
+        self.assertRaises(ValueError, kinect_record.Recording,
+                          DATA_FILE + '_depth.npy')
+
+    def test_replay(self):
+        kinect_record.import_npy(DATA_FILE, self.filename)
+        grabber = kinect.FrameGrabber(
+            kinect_record.RecordingDevice(self.filename, rate=200.0)).start()
+        try:
+            frame = grabber.next_frame(timeout=1.0)
+            self.assertTrue((frame.depth == self.depth).all())
+        finally:
+            grabber.stop()
+
+
+
+class DepthRecordingTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.kdz')
+        # Each bundled frame a few times, as a mostly static session.
+        self.depths = [numpy.load(f + '_depth.npy')
+                       for f in DATA_FILES for i in xrange(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pack_11bit(self):
+        values = numpy.array([0, 1, 2047, 1024, 5, 2046, 3, 7, 1000],
+                             numpy.uint16)
+        packed = kinect_record._pack_11bit(values)
+        self.assertEqual(len(packed), 13)
+        self.assertEqual(list(kinect_record._unpack_11bit(packed, 9)),
+                         list(values))
+
+    def test_lossless(self):
+        with kinect_record.DepthRecorder(self.filename,
+                                         key_interval=7) as recorder:
+            for i, depth in enumerate(self.depths):
+                recorder.write(depth, float(i))
+        frames = list(kinect_record.read_depth_frames(self.filename))
+        self.assertEqual(len(frames), len(self.depths))
+        for i, (frame, depth) in enumerate(zip(frames, self.depths)):
+            self.assertEqual((frame.index, frame.timestamp), (i, float(i)))
+            self.assertTrue(frame.rgb is None)
+            self.assertTrue((frame.depth == depth).all())
+
+    def test_lazy(self):
+        with kinect_record.DepthRecorder(self.filename) as recorder:
+            for depth in self.depths:
+                recorder.write(depth)
+        frames = kinect_record.read_depth_frames(self.filename)
+        self.assertTrue((next(frames).depth == self.depths[0]).all())
+
+    def test_compression_and_throughput(self):
+        with kinect_record.DepthRecorder(self.filename) as recorder:
+            for depth in self.depths:
+                recorder.write(depth)
+        ratio = recorder.raw_size / float(recorder.compressed_size)
+
+        start = time.time()
+        count = sum(1 for frame in
+                    kinect_record.read_depth_frames(self.filename))
+        fps = count / (time.time() - start)
+
+        sys.stderr.write('\ndepth compression ratio: %.1f, '
+                         'decoding: %.0f frames per second ... ' % (ratio, fps))
+        self.assertTrue(ratio > 1.375)  # At least better than 11 bit packing.
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+"""
+kinect_server.py
+
+Obstacle server: capture and obstacle extraction in their own process,
+publishing obstacle frames to games in other processes.
+
+Frames go through a Unix domain datagram socket. A client binds its own
+socket and subscribes by sending SUBSCRIBE to the server socket; the server
+then sends it one datagram per depth frame:
+
+    header      FRAME_HEADER: magic 'KOBS', frame index (uint32), timestamp
+                (float64) and obstacle count n (uint32), little endian
+    obstacles   n * 5 float32, see kinect_pool.OBSTACLE_FIELDS
+
+The server never waits for clients: a client whose queue is full misses
+frames. ObstacleClient.latest() drains its queue without blocking and
+returns the newest frame, so a 60 fps render loop is never held by the
+30 Hz sensor loop.
+
+    python kinect_server.py [-s SOCKET] [--fake]
+
+"""
+
+from collections import namedtuple
+import errno
+import multiprocessing
+import optparse
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+
+import numpy
+
+import kinect
+import kinect_pool
+
+__all__ = ['DEFAULT_SOCKET',
+           'FRAME_HEADER',
+           'MAX_FRAME_SIZE',
+           'ObstacleFrame',
+           'pack_frame',
+           'unpack_frame',
+           'serve',
+           'start_server',
+           'ObstacleClient']
+
+DEFAULT_SOCKET = '/tmp/kinect-obstacles'
+
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+FRAME_HEADER = struct.Struct('<4sIdI')
+_MAGIC = 'KOBS'
+_FIELDS = len(kinect_pool.OBSTACLE_FIELDS)
+
+# Largest frame: at most one obstacle per column of the frame.
+MAX_FRAME_SIZE = FRAME_HEADER.size + 640 * _FIELDS * 4
+
+SUBSCRIBE = 'SUB'
+
+# Returned by unpack_frame and ObstacleClient.latest
+#
+# index         Depth frame index
+# timestamp     Acquisition time of the depth frame
+# obstacles     (n, 5) float32 array, see kinect_pool.OBSTACLE_FIELDS
+ObstacleFrame = namedtuple('ObstacleFrame', 'index timestamp obstacles')
+
+
+def pack_frame(buf, index, timestamp, obstacles):
+    '''Writes a frame into the bytearray buf, returns its size in bytes.
+    obstacles is a list of Obstacle or an (n, 5) array.'''
+    count = len(obstacles)
+    FRAME_HEADER.pack_into(buf, 0, _MAGIC, index, timestamp, count)
+    view = numpy.frombuffer(buf, numpy.float32, count * _FIELDS,
+                            FRAME_HEADER.size).reshape(count, _FIELDS)
+    if isinstance(obstacles, numpy.ndarray):
+        view[:] = obstacles
+    else:
+        kinect_pool.obstacles_to_array(obstacles, view)
+    return FRAME_HEADER.size + view.nbytes
+
+
+def unpack_frame(data):
+    "ObstacleFrame of a datagram. Raises ValueError if it is not a frame."
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError('truncated obstacle frame')
+    magic, index, timestamp, count = FRAME_HEADER.unpack_from(data)
+    if magic != _MAGIC or \
+            len(data) != FRAME_HEADER.size + count * _FIELDS * 4:
+        raise ValueError('not an obstacle frame')
+    obstacles = numpy.frombuffer(data, numpy.float32, count * _FIELDS,
+                                 FRAME_HEADER.size).reshape(count, _FIELDS)
+    return ObstacleFrame(index, timestamp, obstacles)
+
+
+def _bind(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.setblocking(False)
+    return sock
+
+
+def serve(path, device, band=kinect._DEFAULT_ANALYSIS_BAND, stopped=None):
+    '''Publishes the obstacles of a device (FreenectDevice or FakeDevice) on
+    the socket path until stopped (a multiprocessing or threading Event) is
+    set.'''
+    if os.path.exists(path):
+        os.remove(path)
+    sock = _bind(path)
+    subscribers = set()
+    grabber = kinect.FrameGrabber(device, streams=(kinect.DEPTH_STREAM,),
+                                  band=band).start()
+    processor = kinect.DepthProcessor(band)
+    buf = bytearray(MAX_FRAME_SIZE)
+    view = memoryview(buf)
+    index = -1
+    try:
+        while stopped is None or not stopped.is_set():
+            # New subscribers.
+            while True:
+                try:
+                    message, client = sock.recvfrom(len(SUBSCRIBE))
+                except socket.error as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    break
+                if message == SUBSCRIBE and client:
+                    subscribers.add(client)
+
+            frame = grabber.next_frame(index, timeout=0.1)
+            if frame is None:
+                if not grabber.is_running():
+                    break
+                continue
+            index = frame.index
+            size = pack_frame(buf, frame.index, frame.timestamp,
+                              processor.extract_obstacles(frame.depth))
+            for client in list(subscribers):
+                try:
+                    sock.sendto(view[:size], client)
+                except socket.error as e:
+                    # A late client misses the frame, a gone one is dropped.
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                       errno.ENOBUFS):
+                        subscribers.discard(client)
+    finally:
+        grabber.stop()
+        sock.close()
+        os.remove(path)
+
+
+def start_server(path=DEFAULT_SOCKET, files=None, rate=30.0):
+    '''Runs serve in a new process, on the Kinect or, if files are given,
+    replaying them (see kinect.FakeDevice). Returns the process and the
+    event that stops it.'''
+    if files:
+        device = kinect.FakeDevice(files, rate)
+    else:
+        device = kinect.FreenectDevice()
+    stopped = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, name='kinect-server',
+                                      args=(path, device),
+                                      kwargs={'stopped': stopped})
+    process.daemon = True
+    process.start()
+    return process, stopped
+
+
+class ObstacleClient(object):
+    '''Receives obstacle frames from a server.
+
+    client = ObstacleClient(path=DEFAULT_SOCKET)
+        path:       socket of the server
+
+    latest() never blocks. The client subscribes again when it got nothing
+    for RESUBSCRIBE seconds, so it can be started before the server, and
+    survives server restarts.
+    '''
+
+    RESUBSCRIBE = 1.0  # s
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.path = path
+        self._directory = tempfile.mkdtemp(prefix='kinect-client-')
+        self._sock = _bind(os.path.join(self._directory, 'socket'))
+        self._frame = None
+        self._received = 0.0
+        self._subscribed = 0.0
+
+    def _subscribe(self):
+        self._subscribed = time.time()
+        try:
+            self._sock.sendto(SUBSCRIBE, self.path)
+        except socket.error:
+            pass  # No server yet.
+
+    def latest(self):
+        '''Newest frame received, None if none yet. Frames older than the
+        newest one are dropped.'''
+        newest = None
+        while True:
+            try:
+                newest = self._sock.recv(MAX_FRAME_SIZE)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                break
+        now = time.time()
+        if newest is not None:
+            self._frame = unpack_frame(newest)
+            self._received = now
+        elif now - max(self._received, self._subscribed) > self.RESUBSCRIBE:
+            self._subscribe()
+        return self._frame
+
+    def obstacles(self):
+        "Obstacles of the newest frame, as a list of Obstacle."
+        frame = self.latest()
+        if frame is None:
+            return []
+        return kinect_pool.array_to_obstacles(frame.obstacles)
+
+    def close(self):
+        self._sock.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [-s SOCKET] [--fake]')
+    parser.add_option('-s', '--socket', default=DEFAULT_SOCKET,
+                      help='socket to publish on [%default]')
+    parser.add_option('--fake', action='store_true',
+                      help='replay the data/ files instead of the Kinect')
+    options, args = parser.parse_args(argv)
+    if options.fake:
+        device = kinect.FakeDevice(DATA_FILES)
+    else:
+        device = kinect.FreenectDevice()
+    print 'Publishing obstacles on %s' % options.socket
+    try:
+        serve(options.socket, device)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
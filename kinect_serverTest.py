@@ -0,0 +1,102 @@
+import os
+import tempfile
+import time
+import unittest
+import numpy
+import kinect
+import kinect_pool
+import kinect_server
+
+DATA_FILES = ('data/2012-03-02_14-36-48',
+              'data/2012-03-23_12-55-38',
+              'data/2012-03-23_13-21-48',
+              'data/2012-03-30_14-14-43')
+
+
+class FrameTest (unittest.TestCase):
+
+    def test_round_trip(self):
+        obstacles = kinect.extract_obstacles(
+            numpy.load(DATA_FILES[1] + '_depth.npy'))
+        buf = bytearray(kinect_server.MAX_FRAME_SIZE)
+        size = kinect_server.pack_frame(buf, 12, 3.5, obstacles)
+        frame = kinect_server.unpack_frame(bytes(buf[:size]))
+        self.assertEqual((frame.index, frame.timestamp), (12, 3.5))
+        self.assertTrue((frame.obstacles ==
+                         kinect_pool.obstacles_to_array(obstacles)).all())
+
+    def test_invalid(self):
+        buf = bytearray(kinect_server.MAX_FRAME_SIZE)
+        size = kinect_server.pack_frame(buf, 0, 0.0, numpy.zeros((2, 5)))
+        self.assertRaises(ValueError, kinect_server.unpack_frame,
+                          bytes(buf[:size - 1]))
+        self.assertRaises(ValueError, kinect_server.unpack_frame, 'SUB')
+
+
+class ServerTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server')
+        processor = kinect.DepthProcessor()
+        self.expected = [kinect_pool.obstacles_to_array(
+            processor.extract_obstacles(numpy.load(f + '_depth.npy')))
+            for f in DATA_FILES]
+
+    def tearDown(self):
+        os.rmdir(self.directory)
+
+    def wait_frame(self, client, after=-1, timeout=5.0):
+        end = time.time() + timeout
+        while time.time() < end:
+            frame = client.latest()
+            if frame is not None and frame.index > after:
+                return frame
+            time.sleep(0.01)
+        self.fail('no frame from the server')
+
+    def test_replay(self):
+        with kinect_server.ObstacleClient(self.path) as client:
+            client.RESUBSCRIBE = 0.05
+            # Nothing yet, and no waiting.
+            start = time.time()
+            self.assertTrue(client.latest() is None)
+            self.assertTrue(time.time() - start < 0.05)
+
+            process, stopped = kinect_server.start_server(
+                self.path, DATA_FILES, rate=100.0)
+            try:
+                first = self.wait_frame(client)
+                second = self.wait_frame(client, first.index)
+                for frame in (first, second):
+                    self.assertTrue(any(
+                        frame.obstacles.shape == e.shape
+                        and (frame.obstacles == e).all()
+                        for e in self.expected))
+                self.assertEqual(client.obstacles()[0][:5],
+                                 tuple(client.latest().obstacles[0]))
+            finally:
+                stopped.set()
+                process.join(5.0)
+        self.assertFalse(process.is_alive())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_newest_frame(self):
+        process, stopped = kinect_server.start_server(
+            self.path, DATA_FILES, rate=200.0)
+        try:
+            with kinect_server.ObstacleClient(self.path) as client:
+                client.RESUBSCRIBE = 0.05
+                first = self.wait_frame(client)
+                # Frames sent meanwhile are skipped.
+                time.sleep(0.1)
+                newest = client.latest()
+                self.assertTrue(newest.index > first.index + 5)
+                self.assertTrue(client.latest() is newest)
+        finally:
+            stopped.set()
+            process.join(5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()